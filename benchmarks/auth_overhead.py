@@ -0,0 +1,68 @@
+"""
+Микробенчмарк накладных расходов аутентификации на один запрос в режимах
+AUTH_MODE=strict (SELECT пользователя на каждый запрос) и stateless
+(проверенный токен + версия токенов из Redis).
+
+Использует DATABASE_URL и REDIS_URL приложения, схема должна быть создана миграциями:
+
+    python -m benchmarks.auth_overhead --iterations 5000
+"""
+import argparse
+import asyncio
+import json
+import time
+import uuid
+
+from sqlalchemy import delete, insert
+
+from server import auth
+from server.cache import close_redis
+from server.crud import create_jwt_token
+from server.database import SessionLocal, engine
+from server.models import User
+
+
+async def measure(mode: str, user_id: int, token: str, iterations: int) -> dict:
+    auth.AUTH_MODE = mode
+    latencies = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        async with SessionLocal() as db:
+            await auth.get_current_user(db=db, token=token)
+        latencies.append(time.perf_counter() - start)
+    latencies.sort()
+    return {
+        "mode": mode,
+        "iterations": iterations,
+        "mean_us": round(sum(latencies) / len(latencies) * 1e6, 1),
+        "p99_us": round(latencies[int(len(latencies) * 0.99) - 1] * 1e6, 1),
+    }
+
+
+async def run(iterations: int) -> list:
+    email = f"bench-{uuid.uuid4().hex}@example.com"
+    async with SessionLocal() as db:
+        result = await db.execute(insert(User).values(email=email, password_hash="-").returning(User.id))
+        user_id = result.scalar_one()
+        await db.commit()
+
+    token = create_jwt_token(user_id, email)
+    try:
+        return [await measure(mode, user_id, token, iterations) for mode in ("strict", "stateless")]
+    finally:
+        async with SessionLocal() as db:
+            await db.execute(delete(User).where(User.id == user_id))
+            await db.commit()
+        await close_redis()
+        await engine.dispose()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--iterations", type=int, default=5000)
+    args = parser.parse_args()
+    print(json.dumps(asyncio.run(run(args.iterations))))
+
+
+if __name__ == "__main__":
+    main()
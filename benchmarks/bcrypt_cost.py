@@ -0,0 +1,50 @@
+"""
+Пропускная способность входа на одно ядро при разной стоимости bcrypt (BCRYPT_ROUNDS).
+
+Для каждой стоимости замеряется проверка пароля в одном потоке — это и есть
+число логинов в секунду на ядро; оценка для машины умножается на число ядер:
+
+    python -m benchmarks.bcrypt_cost --rounds 10,11,12,13 --iterations 20
+"""
+import argparse
+import json
+import os
+import time
+
+from passlib.context import CryptContext
+
+
+def measure(rounds: int, iterations: int) -> dict:
+    context = CryptContext(schemes=["bcrypt"], bcrypt__rounds=rounds)
+    password_hash = context.hash("benchmark-password")
+    context.verify("benchmark-password", password_hash)  # прогрев
+
+    latencies = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        context.verify("benchmark-password", password_hash)
+        latencies.append(time.perf_counter() - start)
+    latencies.sort()
+    mean = sum(latencies) / len(latencies)
+    cores = os.cpu_count() or 1
+    return {
+        "rounds": rounds,
+        "iterations": iterations,
+        "verify_mean_ms": round(mean * 1000, 2),
+        "verify_p99_ms": round(latencies[max(0, int(len(latencies) * 0.99) - 1)] * 1000, 2),
+        "logins_per_core_per_s": round(1 / mean, 1),
+        "cores": cores,
+        "logins_per_s_estimate": round(cores / mean, 1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rounds", default="10,11,12,13", help="стоимости bcrypt через запятую")
+    parser.add_argument("--iterations", type=int, default=20)
+    args = parser.parse_args()
+    print(json.dumps([measure(int(rounds), args.iterations) for rounds in args.rounds.split(",")]))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,83 @@
+"""
+Всплеск регистраций по одному реферальному коду: проверка кода напрямую в базе
+против кеша (локальный LRU + Redis + объединение одновременных промахов).
+
+Пересоздаёт схему в указанной базе (используйте отдельную базу!):
+
+    python -m benchmarks.code_validation_burst --database-url sqlite+aiosqlite:///burst.db \
+        --fake-redis --burst 2000
+"""
+import argparse
+import asyncio
+import json
+import os
+import time
+from datetime import datetime, timedelta
+
+
+async def run(args) -> list:
+    # Только явно указанная база: схема в ней удаляется и создаётся заново
+    os.environ["DATABASE_URL"] = args.database_url
+    if args.redis_url:
+        os.environ["REDIS_URL"] = args.redis_url
+
+    from server import cache
+    from server.crud import get_valid_referral_code
+    from server.database import Base, SessionLocal, engine
+    from server.instrumentation import RequestStats, request_stats
+    from server.models import User, ReferralCode
+
+    if args.fake_redis:
+        import fakeredis
+        cache.redis_client = fakeredis.aioredis.FakeRedis()
+
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.drop_all)
+        await conn.run_sync(Base.metadata.create_all)
+    async with SessionLocal() as db:
+        db.add(User(id=1, email="burst@example.com", password_hash="-"))
+        db.add(ReferralCode(code="BURST", expiration_date=datetime.utcnow() + timedelta(days=1), user_id=1))
+        await db.commit()
+
+    async def direct():
+        async with SessionLocal() as db:
+            return (await get_valid_referral_code(db, "BURST")).user_id
+
+    async def cached():
+        async with SessionLocal() as db:
+            return await cache.get_referrer_by_code_cached(db, "BURST")
+
+    async def burst(name, check):
+        stats = RequestStats()
+        token = request_stats.set(stats)
+        start = time.perf_counter()
+        results = await asyncio.gather(*(check() for _ in range(args.burst)))
+        elapsed = time.perf_counter() - start
+        request_stats.reset(token)
+        assert set(results) == {1}
+        return {"mode": name, "burst": args.burst, "elapsed_ms": round(elapsed * 1000, 2),
+                "db_queries": stats.queries}
+
+    results = [await burst("direct", direct)]
+    await cache.invalidate_valid_codes(["BURST"])
+    results.append(await burst("cached_cold", cached))
+    results.append(await burst("cached_warm", cached))
+
+    await cache.close_redis()
+    await engine.dispose()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--database-url", required=True,
+                        help="отдельная база для прогона (не DATABASE_URL приложения): схема пересоздаётся")
+    parser.add_argument("--redis-url", help="по умолчанию REDIS_URL из окружения")
+    parser.add_argument("--fake-redis", action="store_true")
+    parser.add_argument("--burst", type=int, default=2000, help="число одновременных проверок кода")
+    args = parser.parse_args()
+    print(json.dumps(asyncio.run(run(args))))
+
+
+if __name__ == "__main__":
+    main()
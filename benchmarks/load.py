@@ -0,0 +1,99 @@
+"""
+Нагрузочный замер пропускной способности API при фиксированной конкурентности.
+
+Запускается против уже поднятого сервиса, поэтому одинаково подходит для
+сравнения двух сборок (до и после изменения):
+
+    python -m benchmarks.load --base-url http://localhost:8000 \
+        --path /referrals/1 --concurrency 50 --requests 5000
+
+Подстрока {n} в теле запроса заменяется номером запроса, например для
+замера регистраций в секунду с уникальными email:
+
+    python -m benchmarks.load --method POST --path /auth/register \
+        --body '{"email": "bench{n}@example.com", "password": "secret"}'
+"""
+import argparse
+import asyncio
+import json
+import statistics
+import time
+
+import httpx
+
+
+def percentile(values, q):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    index = min(len(values) - 1, int(round(q / 100 * (len(values) - 1))))
+    return values[index]
+
+
+async def drive(client: httpx.AsyncClient, make_request, concurrency: int, total: int) -> dict:
+    """
+    Выполняет total запросов в concurrency параллельных воркерах.
+    make_request(n) возвращает (method, path, json) для n-го запроса.
+    """
+    latencies = []
+    errors = 0
+    statuses = {}
+    counter = iter(range(total))
+
+    async def worker():
+        nonlocal errors
+        for n in counter:
+            method, path, payload = make_request(n)
+            start = time.perf_counter()
+            try:
+                response = await client.request(method, path, json=payload)
+                statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+                if response.status_code >= 500:
+                    errors += 1
+            except httpx.HTTPError:
+                errors += 1
+            latencies.append(time.perf_counter() - start)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+
+    return {
+        "concurrency": concurrency,
+        "requests": total,
+        "errors": errors,
+        "statuses": {str(code): count for code, count in sorted(statuses.items())},
+        "rps": round(total / elapsed, 1),
+        "p50_ms": round(percentile(latencies, 50) * 1000, 2),
+        "p95_ms": round(percentile(latencies, 95) * 1000, 2),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 2),
+        "mean_ms": round(statistics.fmean(latencies) * 1000, 2) if latencies else 0.0,
+    }
+
+
+async def run(base_url: str, method: str, path: str, body: str, concurrency: int, total: int) -> dict:
+    def make_request(n):
+        return method, path, json.loads(body.replace("{n}", str(n))) if body else None
+
+    async with httpx.AsyncClient(base_url=base_url, timeout=30,
+                                 limits=httpx.Limits(max_connections=concurrency)) as client:
+        result = await drive(client, make_request, concurrency, total)
+    return {"path": path, **result}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--base-url", default="http://localhost:8000")
+    parser.add_argument("--method", default="GET")
+    parser.add_argument("--path", default="/referrals/1")
+    parser.add_argument("--body", default=None, help="JSON тело запроса, {n} заменяется номером запроса")
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--requests", type=int, default=5000)
+    args = parser.parse_args()
+
+    result = asyncio.run(run(args.base_url, args.method, args.path, args.body, args.concurrency, args.requests))
+    print(json.dumps(result))
+
+
+if __name__ == "__main__":
+    main()
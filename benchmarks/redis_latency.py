@@ -0,0 +1,85 @@
+"""
+Сравнение задержки работы с Redis: синхронный клиент в event loop против
+асинхронного пула, и поштучные команды против pipeline.
+
+    REDIS_URL=redis://localhost:6379/0 python -m benchmarks.redis_latency --keys 1000 --concurrency 50
+"""
+import argparse
+import asyncio
+import json
+import os
+import time
+
+import redis
+from redis import asyncio as aioredis
+
+
+async def bench_sync_in_loop(url: str, keys, concurrency: int) -> float:
+    client = redis.Redis.from_url(url)
+
+    async def worker(chunk):
+        for key in chunk:
+            client.get(key)  # блокирует event loop, как прежний клиент в main.py
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker(keys[i::concurrency]) for i in range(concurrency)))
+    elapsed = time.perf_counter() - start
+    client.close()
+    return elapsed
+
+
+async def bench_async_pool(url: str, keys, concurrency: int) -> float:
+    client = aioredis.Redis.from_url(url, max_connections=concurrency)
+
+    async def worker(chunk):
+        for key in chunk:
+            await client.get(key)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker(keys[i::concurrency]) for i in range(concurrency)))
+    elapsed = time.perf_counter() - start
+    await client.aclose()
+    return elapsed
+
+
+async def bench_pipeline(url: str, keys) -> float:
+    client = aioredis.Redis.from_url(url)
+    start = time.perf_counter()
+    async with client.pipeline(transaction=False) as pipe:
+        for key in keys:
+            pipe.get(key)
+        await pipe.execute()
+    elapsed = time.perf_counter() - start
+    await client.aclose()
+    return elapsed
+
+
+async def run(url: str, count: int, concurrency: int) -> dict:
+    keys = [f"bench:referral_code:{i}@example.com" for i in range(count)]
+    seed = aioredis.Redis.from_url(url)
+    async with seed.pipeline(transaction=False) as pipe:
+        for key in keys:
+            pipe.setex(key, 60, json.dumps({"code": "BENCH", "email": key}))
+        await pipe.execute()
+    await seed.aclose()
+
+    return {
+        "keys": count,
+        "concurrency": concurrency,
+        "sync_in_loop_ms": round(await bench_sync_in_loop(url, keys, concurrency) * 1000, 2),
+        "async_pool_ms": round(await bench_async_pool(url, keys, concurrency) * 1000, 2),
+        "pipeline_ms": round(await bench_pipeline(url, keys) * 1000, 2),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", default=os.getenv("REDIS_URL", "redis://localhost:6379/0"))
+    parser.add_argument("--keys", type=int, default=1000)
+    parser.add_argument("--concurrency", type=int, default=50)
+    args = parser.parse_args()
+    print(json.dumps(asyncio.run(run(args.url, args.keys, args.concurrency))))
+
+
+if __name__ == "__main__":
+    main()
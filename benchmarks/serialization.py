@@ -0,0 +1,93 @@
+"""
+Сериализация ответа со списком рефералов: ORM-объекты через response_model и
+стандартный json (как FastAPI делает по умолчанию) против строк с нужными
+колонками, отдаваемых через orjson.
+
+Пересоздаёт схему в указанной базе (используйте отдельную базу!):
+
+    python -m benchmarks.serialization --database-url sqlite+aiosqlite:///serialization.db --referrals 10000
+"""
+import argparse
+import asyncio
+import json
+import os
+import time
+from typing import List
+
+
+def timed(func, repeat: int) -> float:
+    func()  # прогрев
+    start = time.perf_counter()
+    for _ in range(repeat):
+        func()
+    return (time.perf_counter() - start) / repeat
+
+
+async def run(args) -> list:
+    # Только явно указанная база: схема в ней удаляется и создаётся заново
+    os.environ["DATABASE_URL"] = args.database_url
+
+    from fastapi.encoders import jsonable_encoder
+    from fastapi.responses import JSONResponse, ORJSONResponse
+    from pydantic import TypeAdapter
+    from sqlalchemy import insert, select
+    from server.crud import get_referrals_by_referrer_id
+    from server.database import Base, SessionLocal, engine
+    from server.models import User
+    from server.schemas import UserBase
+
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.drop_all)
+        await conn.run_sync(Base.metadata.create_all)
+        await conn.execute(insert(User), [{"id": 1, "email": "referrer@example.com", "password_hash": "-", "referrer_id": None}] + [
+            {"id": i, "email": f"referral{i}@example.com", "password_hash": "-", "referrer_id": 1}
+            for i in range(2, args.referrals + 2)
+        ])
+
+    async with SessionLocal() as db:
+        start = time.perf_counter()
+        users = (await db.execute(select(User).where(User.referrer_id == 1).order_by(User.id))).scalars().all()
+        orm_fetch = time.perf_counter() - start
+    async with SessionLocal() as db:
+        start = time.perf_counter()
+        rows = await get_referrals_by_referrer_id(db, 1, args.referrals)
+        rows_fetch = time.perf_counter() - start
+
+    adapter = TypeAdapter(List[UserBase])
+
+    def orm_response():
+        # Путь FastAPI по умолчанию: валидация каждого объекта, jsonable_encoder, json.dumps
+        validated = adapter.validate_python(users, from_attributes=True)
+        return JSONResponse(jsonable_encoder(validated)).body
+
+    def rows_response():
+        return ORJSONResponse([row._asdict() for row in rows]).body
+
+    assert json.loads(orm_response()) == json.loads(rows_response())
+
+    results = []
+    for mode, fetch, func in [("orm_pydantic_json", orm_fetch, orm_response), ("rows_orjson", rows_fetch, rows_response)]:
+        results.append({
+            "mode": mode,
+            "referrals": len(rows),
+            "fetch_ms": round(fetch * 1000, 2),
+            "serialize_ms": round(timed(func, args.repeat) * 1000, 2),
+            "body_bytes": len(func()),
+        })
+
+    await engine.dispose()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--database-url", required=True,
+                        help="отдельная база для прогона (не DATABASE_URL приложения): схема пересоздаётся")
+    parser.add_argument("--referrals", type=int, default=10000)
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+    print(json.dumps(asyncio.run(run(args))))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,49 @@
+"""
+Продакшен-запуск: gunicorn управляет несколькими воркерами uvicorn.
+
+    gunicorn server.main:app -c gunicorn.conf.py
+
+Каждый воркер импортирует приложение сам (без preload), поэтому пулы базы,
+Redis и bcrypt создаются после fork и не разделяются между процессами.
+Общий бюджет соединений с базой делится между воркерами.
+"""
+import multiprocessing
+import os
+import shutil
+
+cpu_count = multiprocessing.cpu_count()
+
+bind = os.getenv("BIND", "0.0.0.0:8000")
+workers = int(os.getenv("WEB_CONCURRENCY", str(cpu_count)))
+worker_class = "uvicorn.workers.UvicornWorker"
+preload_app = False
+timeout = int(os.getenv("WORKER_TIMEOUT", "60"))
+graceful_timeout = int(os.getenv("GRACEFUL_TIMEOUT", "30"))
+keepalive = int(os.getenv("KEEPALIVE", "5"))
+# Плавный перезапуск воркеров для защиты от утечек памяти (0 — выключено)
+max_requests = int(os.getenv("MAX_REQUESTS", "0"))
+max_requests_jitter = int(os.getenv("MAX_REQUESTS_JITTER", "0"))
+accesslog = os.getenv("ACCESS_LOG", "-")
+
+# Настройки пулов на воркер, если они не заданы явно: воркеры наследуют окружение мастера
+db_connections = int(os.getenv("DB_MAX_CONNECTIONS", "80"))
+per_worker = max(2, db_connections // workers)
+os.environ.setdefault("DB_POOL_SIZE", str(max(1, per_worker // 2)))
+os.environ.setdefault("DB_MAX_OVERFLOW", str(per_worker - int(os.environ["DB_POOL_SIZE"])))
+# bcrypt уже распараллелен воркерами gunicorn; больше потоков, чем ядер, не даёт выигрыша
+os.environ.setdefault("HASH_WORKERS", str(max(1, cpu_count // workers)))
+
+# Метрики всех воркеров собираются через общий каталог prometheus_client
+os.environ.setdefault("PROMETHEUS_MULTIPROC_DIR", "/tmp/prometheus_multiproc")
+
+
+def on_starting(server):
+    # Файлы метрик прошлого запуска искажают счётчики
+    path = os.environ["PROMETHEUS_MULTIPROC_DIR"]
+    shutil.rmtree(path, ignore_errors=True)
+    os.makedirs(path, exist_ok=True)
+
+
+def child_exit(server, worker):
+    from prometheus_client import multiprocess
+    multiprocess.mark_process_dead(worker.pid)
@@ -16,6 +16,7 @@ if config.config_file_name is not None:
 
 # add your model's MetaData object here
 # for 'autogenerate' support
+from server.config import DATABASE_URL
 from server.database import Base
 from server.models import User, ReferralCode
 # target_metadata = mymodel.Base.metadata
@@ -25,6 +26,15 @@ target_metadata = Base.metadata
 # my_important_option = config.get_main_option("my_important_option")
 # ... etc.
 
+# Миграции выполняются против той же базы, что и приложение (DATABASE_URL),
+# синхронными драйверами: psycopg2 для PostgreSQL и sqlite3 для SQLite
+config.set_main_option(
+    "sqlalchemy.url",
+    DATABASE_URL.replace("+asyncpg", "", 1).replace("+aiosqlite", "", 1).replace("%", "%%"),
+)
+# SQLite не умеет ALTER для ограничений: batch-режим пересоздаёт таблицу
+render_as_batch = DATABASE_URL.startswith("sqlite")
+
 
 def run_migrations_offline() -> None:
     """Run migrations in 'offline' mode.
@@ -42,6 +52,7 @@ def run_migrations_offline() -> None:
     context.configure(
         url=url,
         target_metadata=target_metadata,
+        render_as_batch=render_as_batch,
         literal_binds=True,
         dialect_opts={"paramstyle": "named"},
     )
@@ -65,7 +76,7 @@ def run_migrations_online() -> None:
 
     with connectable.connect() as connection:
         context.configure(
-            connection=connection, target_metadata=target_metadata
+            connection=connection, target_metadata=target_metadata, render_as_batch=render_as_batch
         )
 
         with context.begin_transaction():
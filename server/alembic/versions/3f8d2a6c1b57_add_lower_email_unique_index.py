@@ -0,0 +1,42 @@
+"""Replace the unique index on users.email with one on lower(email)
+
+Revision ID: 3f8d2a6c1b57
+Revises: e7a1c3f5b920
+Create Date: 2026-10-17 17:48:12.674390
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '3f8d2a6c1b57'
+down_revision: Union[str, None] = 'e7a1c3f5b920'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # Уникальный индекс не построится, если есть email, различающиеся только регистром:
+    # их нужно разрешить вручную (список: python -m server.emails duplicates)
+    if not op.get_context().as_sql:
+        duplicates = op.get_bind().execute(sa.text(
+            "SELECT lower(email) FROM users GROUP BY lower(email) HAVING count(*) > 1 LIMIT 10"
+        )).scalars().all()
+        if duplicates:
+            raise RuntimeError(f"Email, различающиеся только регистром: {', '.join(duplicates)}")
+
+    with op.get_context().autocommit_block():
+        op.create_index('ix_users_email_lower', 'users', [sa.text('lower(email)')], unique=True,
+                        postgresql_concurrently=True)
+        # Прежний уникальный индекс по email больше не нужен запросам, а ON CONFLICT (lower(email))
+        # не разрешает конфликты по нему: одновременные вставки одного email падали бы с UniqueViolation
+        op.drop_index('ix_users_email', table_name='users', postgresql_concurrently=True)
+
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        op.create_index('ix_users_email', 'users', ['email'], unique=True, postgresql_concurrently=True)
+        op.drop_index('ix_users_email_lower', table_name='users', postgresql_concurrently=True)
@@ -0,0 +1,30 @@
+"""Add index on users.referrer_id
+
+Revision ID: 4c1e8f2b9a07
+Revises: aa8c55163086
+Create Date: 2026-10-17 10:05:12.118402
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '4c1e8f2b9a07'
+down_revision: Union[str, None] = 'aa8c55163086'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # Индекс строится без блокировки записи в таблицу users
+    with op.get_context().autocommit_block():
+        op.create_index('ix_users_referrer_id_id', 'users', ['referrer_id', 'id'], unique=False,
+                        postgresql_concurrently=True)
+
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        op.drop_index('ix_users_referrer_id_id', table_name='users', postgresql_concurrently=True)
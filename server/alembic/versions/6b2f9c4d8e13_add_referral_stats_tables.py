@@ -0,0 +1,52 @@
+"""Add referral analytics counters and users.referral_code
+
+Revision ID: 6b2f9c4d8e13
+Revises: 9d3a5b7e1f24
+Create Date: 2026-10-17 16:32:05.218734
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '6b2f9c4d8e13'
+down_revision: Union[str, None] = '9d3a5b7e1f24'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # Колонка без значения по умолчанию добавляется без перезаписи таблицы
+    op.add_column('users', sa.Column('referral_code', sa.String(), nullable=True))
+    op.create_table('referral_stats',
+    sa.Column('referrer_id', sa.Integer(), nullable=False),
+    sa.Column('total', sa.Integer(), nullable=False),
+    sa.Column('last_signup_at', sa.DateTime(), nullable=True),
+    sa.ForeignKeyConstraint(['referrer_id'], ['users.id'], ),
+    sa.PrimaryKeyConstraint('referrer_id')
+    )
+    op.create_table('referral_daily_stats',
+    sa.Column('referrer_id', sa.Integer(), nullable=False),
+    sa.Column('day', sa.Date(), nullable=False),
+    sa.Column('signups', sa.Integer(), nullable=False),
+    sa.ForeignKeyConstraint(['referrer_id'], ['users.id'], ),
+    sa.PrimaryKeyConstraint('referrer_id', 'day')
+    )
+    op.create_table('referral_code_stats',
+    sa.Column('referrer_id', sa.Integer(), nullable=False),
+    sa.Column('code', sa.String(), nullable=False),
+    sa.Column('signups', sa.Integer(), nullable=False),
+    sa.ForeignKeyConstraint(['referrer_id'], ['users.id'], ),
+    sa.PrimaryKeyConstraint('referrer_id', 'code')
+    )
+    # Счётчики по уже зарегистрированным пользователям: python -m server.analytics rebuild
+
+
+def downgrade() -> None:
+    op.drop_table('referral_code_stats')
+    op.drop_table('referral_daily_stats')
+    op.drop_table('referral_stats')
+    op.drop_column('users', 'referral_code')
@@ -0,0 +1,27 @@
+"""Add users.token_version for durable token revocation
+
+Revision ID: 8c4b2e9d7a13
+Revises: 3f8d2a6c1b57
+Create Date: 2026-10-17 19:05:41.218734
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '8c4b2e9d7a13'
+down_revision: Union[str, None] = '3f8d2a6c1b57'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # server_default: существующие пользователи получают версию 0, выданные им токены остаются действительными
+    op.add_column('users', sa.Column('token_version', sa.Integer(), server_default='0', nullable=False))
+
+
+def downgrade() -> None:
+    op.drop_column('users', 'token_version')
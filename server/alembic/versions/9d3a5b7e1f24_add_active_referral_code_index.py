@@ -0,0 +1,30 @@
+"""Add index on referral_codes (user_id, expiration_date)
+
+Revision ID: 9d3a5b7e1f24
+Revises: 4c1e8f2b9a07
+Create Date: 2026-10-17 14:21:40.562019
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '9d3a5b7e1f24'
+down_revision: Union[str, None] = '4c1e8f2b9a07'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    with op.get_context().autocommit_block():
+        op.create_index('ix_referral_codes_user_id_expiration_date', 'referral_codes',
+                        ['user_id', 'expiration_date'], unique=False, postgresql_concurrently=True)
+
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        op.drop_index('ix_referral_codes_user_id_expiration_date', table_name='referral_codes',
+                      postgresql_concurrently=True)
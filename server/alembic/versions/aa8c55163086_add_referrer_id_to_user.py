@@ -20,13 +20,15 @@ depends_on: Union[str, Sequence[str], None] = None
 
 def upgrade() -> None:
     # ### commands auto generated by Alembic - please adjust! ###
-    op.add_column('users', sa.Column('referrer_id', sa.Integer(), nullable=True))
-    op.create_foreign_key(None, 'users', 'users', ['referrer_id'], ['id'])
+    with op.batch_alter_table('users') as batch_op:
+        batch_op.add_column(sa.Column('referrer_id', sa.Integer(), nullable=True))
+        batch_op.create_foreign_key('users_referrer_id_fkey', 'users', ['referrer_id'], ['id'])
     # ### end Alembic commands ###
 
 
 def downgrade() -> None:
     # ### commands auto generated by Alembic - please adjust! ###
-    op.drop_constraint(None, 'users', type_='foreignkey')
-    op.drop_column('users', 'referrer_id')
+    with op.batch_alter_table('users') as batch_op:
+        batch_op.drop_constraint('users_referrer_id_fkey', type_='foreignkey')
+        batch_op.drop_column('referrer_id')
     # ### end Alembic commands ###
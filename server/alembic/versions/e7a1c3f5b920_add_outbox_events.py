@@ -0,0 +1,38 @@
+"""Add outbox_events table
+
+Revision ID: e7a1c3f5b920
+Revises: 6b2f9c4d8e13
+Create Date: 2026-10-17 17:05:44.903126
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'e7a1c3f5b920'
+down_revision: Union[str, None] = '6b2f9c4d8e13'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table('outbox_events',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('event_id', sa.String(), nullable=False),
+    sa.Column('event_type', sa.String(), nullable=False),
+    sa.Column('payload', sa.JSON(), nullable=False),
+    sa.Column('created_at', sa.DateTime(), nullable=False),
+    sa.Column('attempts', sa.Integer(), nullable=False),
+    sa.Column('next_attempt_at', sa.DateTime(), nullable=False),
+    sa.Column('last_error', sa.String(), nullable=True),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index('ix_outbox_events_next_attempt_at_id', 'outbox_events', ['next_attempt_at', 'id'], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index('ix_outbox_events_next_attempt_at_id', table_name='outbox_events')
+    op.drop_table('outbox_events')
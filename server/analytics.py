@@ -0,0 +1,75 @@
+"""
+Пересчёт счётчиков аналитики рефералов по таблице users.
+
+Счётчики обновляются инкрементально при каждой регистрации по реферальному
+коду; пересчёт нужен для заполнения после миграции и для исправления
+расхождений:
+
+    python -m server.analytics rebuild
+"""
+import argparse
+import asyncio
+import json
+
+from sqlalchemy import delete, func, insert, select, text
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from .database import SessionLocal, engine
+from .models import User, ReferralStats, ReferralDailyStats, ReferralCodeStats
+
+
+async def rebuild_referral_stats(db: AsyncSession) -> dict:
+    """
+    Заменяет все счётчики агрегатами по users одной транзакцией.
+    В PostgreSQL таблицы счётчиков блокируются на время пересчёта: регистрации,
+    пришедшие в это время, дождутся блокировки и увеличат уже пересчитанные значения.
+    """
+    if db.bind.dialect.name == "postgresql":
+        await db.execute(text(
+            "LOCK TABLE referral_stats, referral_daily_stats, referral_code_stats IN EXCLUSIVE MODE"
+        ))
+    for model in (ReferralCodeStats, ReferralDailyStats, ReferralStats):
+        await db.execute(delete(model))
+
+    referrals = User.referrer_id.isnot(None)
+    day = func.date(User.created_at)
+    await db.execute(insert(ReferralStats).from_select(
+        ["referrer_id", "total", "last_signup_at"],
+        select(User.referrer_id, func.count(), func.max(User.created_at)).where(referrals).group_by(User.referrer_id),
+    ))
+    await db.execute(insert(ReferralDailyStats).from_select(
+        ["referrer_id", "day", "signups"],
+        select(User.referrer_id, day, func.count()).where(referrals).group_by(User.referrer_id, day),
+    ))
+    # Пользователи, зарегистрированные до появления users.referral_code, учитываются только в итогах
+    await db.execute(insert(ReferralCodeStats).from_select(
+        ["referrer_id", "code", "signups"],
+        select(User.referrer_id, User.referral_code, func.count())
+        .where(referrals, User.referral_code.isnot(None))
+        .group_by(User.referrer_id, User.referral_code),
+    ))
+
+    counts = {}
+    for model in (ReferralStats, ReferralDailyStats, ReferralCodeStats):
+        counts[model.__tablename__] = (await db.execute(select(func.count()).select_from(model))).scalar_one()
+    await db.commit()
+    return counts
+
+
+async def _run_cli() -> dict:
+    try:
+        async with SessionLocal() as db:
+            return await rebuild_referral_stats(db)
+    finally:
+        await engine.dispose()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("command", choices=["rebuild"])
+    parser.parse_args()
+    print(json.dumps(asyncio.run(_run_cli())))
+
+
+if __name__ == "__main__":
+    main()
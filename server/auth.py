@@ -0,0 +1,98 @@
+import hmac
+from typing import Optional
+
+from fastapi import HTTPException, Depends, Header
+from fastapi.security import OAuth2PasswordBearer
+from jose import JWTError, jwt
+from sqlalchemy import select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from .cache import redis_call, UNAVAILABLE
+from .config import ADMIN_TOKEN, AUTH_MODE, AUTH_USER_CACHE_TTL
+from .crud import SECRET_KEY, ALGORITHM
+from .database import get_db
+from .models import User
+from .schemas import CurrentUser
+
+oauth2_scheme = OAuth2PasswordBearer(tokenUrl="auth/login")
+
+def token_version_key(user_id: int) -> str:
+    return f"token_version:{user_id}"
+
+
+async def revoke_user(db: AsyncSession, user_id: int) -> bool:
+    """
+    Отзывает все выданные пользователю токены: версия токенов в базе увеличивается,
+    и токены с прежней версией отклоняются в обоих режимах AUTH_MODE. Копия версии
+    в Redis перезаписывается сразу; если Redis недоступен, она устареет не позже
+    чем через AUTH_USER_CACHE_TTL секунд. Возвращает False, если пользователя нет.
+    """
+    result = await db.execute(
+        update(User).where(User.id == user_id)
+        .values(token_version=User.token_version + 1)
+        .returning(User.token_version)
+    )
+    version = result.scalar_one_or_none()
+    await db.commit()
+    if version is None:
+        return False
+
+    await redis_call(lambda r: r.set(token_version_key(user_id), version, ex=AUTH_USER_CACHE_TTL), invalidation=True)
+    return True
+
+
+# Функция для получения текущего пользователя
+async def get_current_user(db: AsyncSession = Depends(get_db), token: str = Depends(oauth2_scheme)) -> CurrentUser:
+    """
+    Извлекает и проверяет JWT токен, возвращает текущего пользователя.
+
+    Версия токена (claim "ver") должна совпадать с версией пользователя. В режиме
+    AUTH_MODE=stateless версия читается из Redis, а база опрашивается только при
+    промахе или недоступности Redis. В режиме strict пользователь и версия
+    проверяются в базе, а Redis не опрашивается.
+    """
+    credentials_exception = HTTPException(
+        status_code=401,
+        detail="Could not validate credentials",
+        headers={"WWW-Authenticate": "Bearer"},
+    )
+
+    try:
+        # Декодируем токен
+        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+        user_id: int = payload.get("user_id")
+        email: str = payload.get("email")
+        if user_id is None:
+            raise credentials_exception
+    except JWTError:
+        raise credentials_exception
+
+    token_version = payload.get("ver", 0)
+
+    if AUTH_MODE == "stateless":
+        # Копия версии в Redis заменяет запрос к базе; промах или недоступный Redis — идём в базу
+        cached = await redis_call(lambda r: r.get(token_version_key(user_id)), default=UNAVAILABLE)
+        if cached is not None and cached is not UNAVAILABLE:
+            if int(cached) != token_version:
+                raise credentials_exception
+            return CurrentUser(id=user_id, email=email)
+
+    # Проверяем, что пользователь существует и токен не отозван
+    result = await db.execute(select(User.id, User.email, User.token_version).where(User.id == user_id))
+    user = result.first()
+    if user is None or user.token_version != token_version:
+        raise credentials_exception
+
+    if AUTH_MODE == "stateless":
+        # NX: версия, прочитанная до отзыва, не перезаписывает записанную revoke_user
+        await redis_call(lambda r: r.set(token_version_key(user_id), user.token_version,
+                                         ex=AUTH_USER_CACHE_TTL, nx=True))
+    return CurrentUser(id=user.id, email=user.email)
+
+
+# Доступ к административным эндпоинтам (массовый импорт) по токену из ADMIN_TOKEN
+async def require_admin_token(x_admin_token: Optional[str] = Header(None)):
+    if not ADMIN_TOKEN:
+        raise HTTPException(status_code=403, detail="Административные операции отключены")
+    if x_admin_token is None or not hmac.compare_digest(x_admin_token, ADMIN_TOKEN):
+        raise HTTPException(status_code=403, detail="Недостаточно прав")
@@ -0,0 +1,276 @@
+"""
+Массовый импорт пользователей и реферальных кодов.
+
+Все строки проверяются до записи, пароли хешируются параллельно в пуле bcrypt,
+пользователи вставляются пачками INSERT ... ON CONFLICT DO NOTHING RETURNING,
+реферальные коды — тем же INSERT ... WHERE NOT EXISTS, что и /referral-code/create.
+Используется эндпоинтами /bulk/* и из командной строки:
+
+    python -m server.bulk users users.ndjson
+    python -m server.bulk referral-codes codes.json
+"""
+import argparse
+import asyncio
+import json
+import sys
+from datetime import datetime
+from typing import Dict, List, Optional
+
+from pydantic import ValidationError
+from sqlalchemy import func, select, bindparam, Integer, String, DateTime
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from .cache import invalidate_referral_codes, invalidate_referral_trees, invalidate_valid_codes
+from .config import BULK_BATCH_SIZE, BULK_HASH_CHUNK_SIZE, BULK_HASH_WORKERS, REFERRAL_TREE_MAX_DEPTH
+from .crud import get_referrer_chain, record_referral_signups, add_outbox_events, user_registered_event, \
+    lock_referral_code_users, insert_referral_code_if_no_active
+from .database import SessionLocal, engine, insert
+from .hashing import hashing_pool, hash_passwords_sync, pwd_context
+from .models import User, ReferralCode
+from .schemas import BulkUserRow, BulkReferralCodeRow, BulkRowResult, BulkImportResult
+
+
+class _InvalidLine:
+    def __init__(self, error: str):
+        self.error = error
+
+
+def parse_rows(body: bytes) -> list:
+    """
+    Принимает JSON-массив или NDJSON. Ошибка разбора отдельной строки NDJSON
+    не прерывает импорт, а попадает в результат этой строки.
+    """
+    body = body.strip()
+    if body.startswith(b"["):
+        rows = json.loads(body)
+        if not isinstance(rows, list):
+            raise ValueError("Ожидается JSON-массив")
+        return rows
+
+    rows = []
+    for line in body.splitlines():
+        if not line.strip():
+            continue
+        try:
+            rows.append(json.loads(line))
+        except ValueError as exc:
+            rows.append(_InvalidLine(f"Некорректный JSON: {exc}"))
+    return rows
+
+
+def _validate(rows: list, model) -> tuple:
+    valid, results = [], {}
+    for index, raw in enumerate(rows):
+        if isinstance(raw, _InvalidLine):
+            results[index] = BulkRowResult(index=index, status="invalid", error=raw.error)
+            continue
+        try:
+            valid.append((index, model.model_validate(raw)))
+        except ValidationError as exc:
+            results[index] = BulkRowResult(index=index, status="invalid", error=str(exc.errors()[0]["msg"]))
+    return valid, results
+
+
+def _summary(results: Dict[int, BulkRowResult]) -> BulkImportResult:
+    rows = [results[index] for index in sorted(results)]
+    return BulkImportResult(
+        created=sum(row.status == "created" for row in rows),
+        duplicates=sum(row.status == "duplicate" for row in rows),
+        invalid=sum(row.status == "invalid" for row in rows),
+        rows=rows,
+    )
+
+
+def _batches(items: list, size: int):
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+
+async def import_users(db: AsyncSession, raw_rows: list) -> BulkImportResult:
+    valid, results = _validate(raw_rows, BulkUserRow)
+
+    # Проверки без обращения к базе: пароль или хеш, повторы email внутри файла
+    rows: List[tuple] = []
+    seen_emails = set()
+    for index, row in valid:
+        if (row.password is None) == (row.password_hash is None):
+            results[index] = BulkRowResult(index=index, status="invalid",
+                                           error="Нужно указать либо password, либо password_hash")
+        elif row.password_hash is not None and pwd_context.identify(row.password_hash) != "bcrypt":
+            results[index] = BulkRowResult(index=index, status="invalid", error="password_hash не является bcrypt-хешем")
+        elif row.email in seen_emails:
+            results[index] = BulkRowResult(index=index, status="duplicate")
+        else:
+            seen_emails.add(row.email)
+            rows.append((index, row))
+
+    # Все реферальные коды файла проверяются одним запросом
+    codes = {row.referral_code for _, row in rows if row.referral_code}
+    referrers: Dict[str, int] = {}
+    if codes:
+        result = await db.execute(select(ReferralCode.code, ReferralCode.user_id).where(
+            ReferralCode.code.in_(codes),
+            ReferralCode.expiration_date >= datetime.utcnow()
+        ))
+        referrers = dict(result.all())
+    resolved = []
+    for index, row in rows:
+        if row.referral_code and row.referral_code not in referrers:
+            results[index] = BulkRowResult(index=index, status="invalid",
+                                           error="Недействительный или истекший реферальный код")
+        else:
+            resolved.append((index, row))
+
+    # Пароли хешируются параллельно не больше чем в BULK_HASH_WORKERS воркерах пула
+    plain = [row.password for _, row in resolved if row.password_hash is None]
+    hashes = iter(await hashing_pool.run_many("hash_bulk", hash_passwords_sync, plain, BULK_HASH_CHUNK_SIZE,
+                                              BULK_HASH_WORKERS))
+
+    now = datetime.utcnow()
+    values = []
+    for index, row in resolved:
+        values.append((index, {
+            "email": row.email,
+            "password_hash": row.password_hash if row.password_hash is not None else next(hashes),
+            "referrer_id": referrers.get(row.referral_code) if row.referral_code else None,
+            "referral_code": row.referral_code or None,
+            "created_at": now,
+        }))
+
+    affected_referrers = set()
+    for batch in _batches(values, BULK_BATCH_SIZE):
+        statement = (
+            insert(User)
+            .values([value for _, value in batch])
+            .on_conflict_do_nothing(index_elements=[func.lower(User.email)])
+            .returning(User.id, User.email)
+        )
+        created = dict((email, user_id) for user_id, email in (await db.execute(statement)).all())
+        # Счётчики аналитики и события outbox фиксируются в той же транзакции, что и пачка пользователей
+        await record_referral_signups(db, [
+            (value["referrer_id"], value["referral_code"], value["created_at"])
+            for _, value in batch if value["email"] in created and value["referrer_id"] is not None
+        ])
+        await add_outbox_events(db, [
+            user_registered_event(created[value["email"]], value["email"], value["referrer_id"],
+                                  value["referral_code"], value["created_at"])
+            for _, value in batch if value["email"] in created
+        ])
+        await db.commit()
+        for index, value in batch:
+            user_id = created.get(value["email"])
+            results[index] = BulkRowResult(index=index, status="created" if user_id else "duplicate", id=user_id)
+            if user_id and value["referrer_id"] is not None:
+                affected_referrers.add(value["referrer_id"])
+
+    # Сбрасываем кеш сводок деревьев, в которые добавились новые рефералы
+    for referrer_id in affected_referrers:
+        await invalidate_referral_trees(await get_referrer_chain(db, referrer_id, REFERRAL_TREE_MAX_DEPTH))
+
+    return _summary(results)
+
+
+async def import_referral_codes(db: AsyncSession, raw_rows: list) -> BulkImportResult:
+    valid, results = _validate(raw_rows, BulkReferralCodeRow)
+
+    # Существующие пользователи и уже активные коды — двумя запросами на весь файл
+    user_ids = {row.user_id for _, row in valid}
+    existing_users = set()
+    active_users = set()
+    if user_ids:
+        existing_users = set((await db.execute(select(User.id).where(User.id.in_(user_ids)))).scalars())
+        active_users = set((await db.execute(select(ReferralCode.user_id).where(
+            ReferralCode.user_id.in_(user_ids),
+            ReferralCode.expiration_date > datetime.utcnow()
+        ))).scalars())
+
+    now = datetime.utcnow()
+    rows = []
+    seen_codes = set()
+    for index, row in valid:
+        if row.user_id not in existing_users:
+            results[index] = BulkRowResult(index=index, status="invalid", error="Пользователь не найден")
+        elif row.code in seen_codes:
+            results[index] = BulkRowResult(index=index, status="duplicate")
+        elif row.expiration_date > now and row.user_id in active_users:
+            # Одновременно может быть активен только один код пользователя
+            results[index] = BulkRowResult(index=index, status="invalid",
+                                           error="У пользователя уже есть активный реферальный код")
+        else:
+            seen_codes.add(row.code)
+            if row.expiration_date > now:
+                active_users.add(row.user_id)
+            rows.append((index, {"code": row.code, "expiration_date": row.expiration_date, "user_id": row.user_id}))
+
+    # Тот же INSERT ... WHERE NOT EXISTS, что и у /referral-code/create, под теми же блокировками пользователей:
+    # проверка выше только отсеивает заведомо лишние строки и не защищает от параллельного создания кода
+    statement = insert_referral_code_if_no_active(
+        bindparam("code", type_=String), bindparam("expiration_date", type_=DateTime), bindparam("user_id", type_=Integer)
+    )
+    created_for_users = set()
+    created_codes = []
+    for batch in _batches(rows, BULK_BATCH_SIZE):
+        await lock_referral_code_users(db, [value["user_id"] for _, value in batch if value["expiration_date"] > now])
+        codes = [value["code"] for _, value in batch]
+        existing = set((await db.execute(select(ReferralCode.code).where(ReferralCode.code.in_(codes)))).scalars())
+        new = [value for _, value in batch if value["code"] not in existing]
+        stored = {}
+        if new:
+            # executemany через соединение (без ORM bulk insert) не возвращает строки,
+            # поэтому вставленные коды читаются следующим запросом
+            await (await db.connection()).execute(statement, new)
+            result = await db.execute(
+                select(ReferralCode.code, ReferralCode.id, ReferralCode.user_id, ReferralCode.expiration_date)
+                .where(ReferralCode.code.in_([value["code"] for value in new]))
+            )
+            stored = {code: (code_id, user_id, expiration_date) for code, code_id, user_id, expiration_date in result}
+        await db.commit()
+        for index, value in batch:
+            row = stored.get(value["code"])
+            # Код с другим владельцем или сроком вставила параллельная транзакция
+            if value["code"] in existing or (row and row[1:] != (value["user_id"], value["expiration_date"])):
+                results[index] = BulkRowResult(index=index, status="duplicate")
+            elif row is None:
+                results[index] = BulkRowResult(index=index, status="invalid",
+                                               error="У пользователя уже есть активный реферальный код")
+            else:
+                results[index] = BulkRowResult(index=index, status="created", id=row[0])
+                created_for_users.add(value["user_id"])
+                created_codes.append(value["code"])
+
+    # Закешированное отсутствие кода у этих пользователей и самих кодов больше не актуально
+    await invalidate_valid_codes(created_codes)
+    if created_for_users:
+        emails = (await db.execute(select(User.email).where(User.id.in_(created_for_users)))).scalars().all()
+        await invalidate_referral_codes(emails)
+
+    return _summary(results)
+
+
+async def _run_cli(kind: str, path: Optional[str]) -> BulkImportResult:
+    body = sys.stdin.buffer.read() if path in (None, "-") else open(path, "rb").read()
+    importer = import_users if kind == "users" else import_referral_codes
+    try:
+        async with SessionLocal() as db:
+            return await importer(db, parse_rows(body))
+    finally:
+        hashing_pool.shutdown()
+        await engine.dispose()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("kind", choices=["users", "referral-codes"])
+    parser.add_argument("path", nargs="?", help="JSON или NDJSON файл; по умолчанию stdin")
+    parser.add_argument("--verbose", action="store_true", help="выводить результат по каждой строке")
+    args = parser.parse_args()
+
+    result = asyncio.run(_run_cli(args.kind, args.path))
+    if args.verbose:
+        print(result.model_dump_json())
+    else:
+        print(json.dumps({"created": result.created, "duplicates": result.duplicates, "invalid": result.invalid}))
+
+
+if __name__ == "__main__":
+    main()
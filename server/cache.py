@@ -0,0 +1,310 @@
+import asyncio
+import logging
+import time
+from datetime import datetime, timezone
+from typing import Dict, Iterable, Optional
+
+import orjson
+from redis import asyncio as aioredis
+from redis.exceptions import RedisError
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from .config import (REDIS_URL, REDIS_MAX_CONNECTIONS, REDIS_SOCKET_TIMEOUT, REDIS_RETRY_INTERVAL,
+                     REDIS_INVALIDATION_RETRIES,
+                     REFERRAL_CODE_CACHE_TTL, REFERRAL_CODE_NEGATIVE_TTL, REFERRAL_CODE_INVALIDATION_TTL,
+                     REFERRAL_TREE_MAX_NODES,
+                     REFERRAL_TREE_CACHE_TTL, REFERRAL_CODE_LOCAL_CACHE_SIZE, REFERRAL_CODE_LOCAL_TTL)
+from .crud import get_referral_code_by_email, get_referral_tree_levels, get_valid_referral_code
+from .lru import TTLCache
+from .schemas import normalize_email
+from .metrics import CACHE_REQUESTS, REDIS_ERRORS
+
+logger = logging.getLogger(__name__)
+
+# Асинхронный пул соединений с Redis
+redis_pool = aioredis.ConnectionPool.from_url(
+    REDIS_URL,
+    max_connections=REDIS_MAX_CONNECTIONS,
+    socket_timeout=REDIS_SOCKET_TIMEOUT,
+    socket_connect_timeout=REDIS_SOCKET_TIMEOUT,
+)
+redis_client = aioredis.Redis(connection_pool=redis_pool)
+
+# Маркер отрицательного результата: у пользователя нет активного кода
+NEGATIVE_MARKER = b""
+# Маркер недавней инвалидации: read-through заполнение (SET NX) не заменяет его результатом
+# чтения из базы, начатого до удаления кода
+INVALIDATED_MARKER = b"invalidated"
+
+# Момент, до которого Redis считается недоступным
+_retry_at = 0.0
+
+# Значение по умолчанию, по которому промах кеша отличается от недоступного Redis
+UNAVAILABLE = object()
+
+
+async def redis_call(operation, default=None, invalidation: bool = False):
+    """
+    Выполняет операцию с Redis. Если Redis недоступен, возвращает default,
+    и в течение REDIS_RETRY_INTERVAL секунд запросы к нему не отправляются.
+
+    Сброс ключей (invalidation=True) отправляется и во время этой паузы и
+    повторяется REDIS_INVALIDATION_RETRIES раз: пропущенный сброс оставил бы
+    в кеше других воркеров уже удалённый код.
+    """
+    global _retry_at
+    if not invalidation and time.monotonic() < _retry_at:
+        return default
+    attempts = 1 + (REDIS_INVALIDATION_RETRIES if invalidation else 0)
+    for _ in range(attempts):
+        try:
+            return await operation(redis_client)
+        except RedisError as exc:
+            REDIS_ERRORS.inc()
+            _retry_at = time.monotonic() + REDIS_RETRY_INTERVAL
+            error = exc
+    if invalidation:
+        logger.error("Не удалось сбросить ключи кеша в Redis: %s", error)
+    else:
+        logger.warning("Redis недоступен, работаем без кеша: %s", error)
+    return default
+
+
+async def _fill(key: str, ttl: int, value: bytes):
+    """
+    Записывает результат чтения из базы, только если ключа нет: маркер
+    инвалидации и значение, записанное после изменения, не перезаписываются.
+    Возвращает True, None (ключ уже есть) или UNAVAILABLE.
+    """
+    return await redis_call(lambda r: r.set(key, value, ex=ttl, nx=True), default=UNAVAILABLE)
+
+
+async def _invalidate(keys: list) -> None:
+    async def mark(r):
+        # Маркеры пачкой за один round trip
+        async with r.pipeline(transaction=False) as pipe:
+            for key in keys:
+                pipe.set(key, INVALIDATED_MARKER, ex=REFERRAL_CODE_INVALIDATION_TTL)
+            return await pipe.execute()
+
+    if keys:
+        await redis_call(mark, invalidation=True)
+
+
+def _count(cache: str, cached) -> None:
+    result = "error" if cached is UNAVAILABLE else "miss" if cached is None else "hit"
+    CACHE_REQUESTS.labels(cache, result).inc()
+
+
+async def close_redis():
+    await redis_client.aclose(close_connection_pool=True)
+
+
+async def ping_redis() -> bool:
+    return bool(await redis_call(lambda r: r.ping(), default=False))
+
+
+async def warm_up_redis(connections: int):
+    # Одновременные PING открывают соответствующее число соединений в пуле
+    await asyncio.gather(*(ping_redis() for _ in range(connections)))
+
+
+def referral_code_key(email: str) -> str:
+    return f"referral_code:{normalize_email(email)}"
+
+
+def _ttl_until(expiration_date: datetime) -> int:
+    # TTL записи не должен пережить срок действия самого кода
+    seconds_left = int((expiration_date - datetime.utcnow()).total_seconds())
+    return min(REFERRAL_CODE_CACHE_TTL, seconds_left)
+
+
+def _referral_code_payload(email: str, code: str) -> bytes:
+    return orjson.dumps({"code": code, "email": normalize_email(email)})
+
+
+async def cache_referral_code(email: str, code: str, expiration_date: datetime) -> None:
+    """
+    Кладёт актуальный реферальный код в кеш (вызывается и при создании кода).
+    """
+    ttl = _ttl_until(expiration_date)
+    if ttl <= 0:
+        await invalidate_referral_codes([email])
+        return
+    payload = _referral_code_payload(email, code)
+    await redis_call(lambda r: r.setex(referral_code_key(email), ttl, payload))
+
+
+async def invalidate_referral_codes(emails: Iterable[str]) -> None:
+    await _invalidate([referral_code_key(email) for email in emails])
+
+
+async def get_referral_code_cached(db: AsyncSession, email: str) -> Optional[bytes]:
+    """
+    Read-through кеш: при промахе загружает активный код из базы и кеширует его.
+    Отсутствие кода тоже кешируется, но ненадолго. Если Redis недоступен,
+    код читается напрямую из базы. Возвращает готовое JSON-тело ответа.
+    """
+    key = referral_code_key(email)
+    cached = await redis_call(lambda r: r.get(key), default=UNAVAILABLE)
+    if cached == INVALIDATED_MARKER:
+        cached = None
+    _count("referral_code", cached)
+    if cached is not None and cached is not UNAVAILABLE:
+        if cached == NEGATIVE_MARKER:
+            return None
+        return cached
+
+    row = await get_referral_code_by_email(db, email)
+    if row is None:
+        await _fill(key, REFERRAL_CODE_NEGATIVE_TTL, NEGATIVE_MARKER)
+        return None
+
+    payload = _referral_code_payload(email, row.code)
+    ttl = _ttl_until(row.expiration_date)
+    if ttl > 0:
+        await _fill(key, ttl, payload)
+    return payload
+
+
+def referral_tree_key(referrer_id: int) -> str:
+    # Хеш: поле — max_depth, значение — сводка дерева
+    return f"referral_tree:{referrer_id}"
+
+
+async def get_referral_tree_cached(db: AsyncSession, referrer_id: int, max_depth: int) -> bytes:
+    # Возвращает готовое JSON-тело: закешированная сводка отдаётся без разбора
+    key = referral_tree_key(referrer_id)
+    cached = await redis_call(lambda r: r.hget(key, max_depth), default=UNAVAILABLE)
+    _count("referral_tree", cached)
+    if cached is not None and cached is not UNAVAILABLE:
+        return cached
+
+    levels = list(await get_referral_tree_levels(db, referrer_id, max_depth, REFERRAL_TREE_MAX_NODES))
+    truncated = sum(count for _, count in levels) > REFERRAL_TREE_MAX_NODES
+    if truncated:
+        # Лишний узел только показывает, что дерево обрезано: убираем его из последнего уровня
+        depth, count = levels.pop()
+        if count > 1:
+            levels.append((depth, count - 1))
+    summary = {
+        "referrer_id": referrer_id,
+        "total": sum(count for _, count in levels),
+        "depth": levels[-1][0] if levels else 0,
+        "levels": [{"depth": depth, "count": count} for depth, count in levels],
+        "truncated": truncated,
+    }
+
+    payload = orjson.dumps(summary)
+
+    async def store(r):
+        async with r.pipeline(transaction=False) as pipe:
+            pipe.hset(key, max_depth, payload)
+            pipe.expire(key, REFERRAL_TREE_CACHE_TTL)
+            return await pipe.execute()
+
+    await redis_call(store)
+    return payload
+
+
+async def invalidate_referral_trees(referrer_ids: Iterable[int]) -> None:
+    keys = [referral_tree_key(referrer_id) for referrer_id in referrer_ids]
+    if keys:
+        await redis_call(lambda r: r.delete(*keys), invalidation=True)
+
+
+# Проверка реферальных кодов при регистрации: локальный LRU -> Redis -> база.
+# Локальный кеш живёт секунды, поэтому удаление кода другим воркером видно почти сразу.
+valid_code_cache = TTLCache(maxsize=REFERRAL_CODE_LOCAL_CACHE_SIZE, ttl=REFERRAL_CODE_LOCAL_TTL)
+# Загрузки кодов, которые уже выполняются: одновременные промахи ждут один запрос к базе
+_valid_code_loads: Dict[str, asyncio.Future] = {}
+
+
+def valid_code_key(code: str) -> str:
+    return f"referral_code_valid:{code}"
+
+
+def _referrer_if_valid(entry) -> Optional[int]:
+    # entry: (user_id, срок действия в unix-времени) или None для отсутствующего кода
+    if entry is None or entry[1] <= time.time():
+        return None
+    return entry[0]
+
+
+def _valid_code_entry(user_id: int, expiration_date: datetime) -> tuple:
+    # Сроки в базе хранятся в UTC без часового пояса
+    return user_id, expiration_date.replace(tzinfo=timezone.utc).timestamp()
+
+
+async def _load_valid_code(db: AsyncSession, code: str):
+    key = valid_code_key(code)
+    cached = await redis_call(lambda r: r.get(key), default=UNAVAILABLE)
+    if cached == INVALIDATED_MARKER:
+        cached = None
+    _count("referral_code_valid", cached)
+    if cached is not None and cached is not UNAVAILABLE:
+        entry = tuple(orjson.loads(cached)) if cached != NEGATIVE_MARKER else None
+        ttl = entry[1] - time.time() if entry else REFERRAL_CODE_NEGATIVE_TTL
+        valid_code_cache.set(code, entry, ttl)
+        return entry
+
+    referral = await get_valid_referral_code(db, code)
+    if referral is None:
+        entry, ttl, value = None, REFERRAL_CODE_NEGATIVE_TTL, NEGATIVE_MARKER
+    else:
+        entry = _valid_code_entry(referral.user_id, referral.expiration_date)
+        ttl, value = _ttl_until(referral.expiration_date), orjson.dumps(entry)
+    if ttl > 0 and await _fill(key, ttl, value) is not None:
+        # Ключ не записан — код изменился во время чтения, поэтому ответ базы не кешируется и локально
+        valid_code_cache.set(code, entry, ttl)
+    return entry
+
+
+async def get_referrer_by_code_cached(db: AsyncSession, code: str) -> Optional[int]:
+    """
+    Возвращает id владельца действующего реферального кода или None.
+    Одновременные промахи по одному коду объединяются в один запрос к базе.
+    """
+    entry = valid_code_cache.get(code, UNAVAILABLE)
+    if entry is not UNAVAILABLE:
+        CACHE_REQUESTS.labels("referral_code_valid_local", "hit").inc()
+        return _referrer_if_valid(entry)
+    CACHE_REQUESTS.labels("referral_code_valid_local", "miss").inc()
+
+    load = _valid_code_loads.get(code)
+    if load is not None:
+        CACHE_REQUESTS.labels("referral_code_valid_local", "coalesced").inc()
+        entry = await asyncio.shield(load)
+        if entry is not UNAVAILABLE:
+            return _referrer_if_valid(entry)
+        # Ведущий запрос завершился ошибкой — загружаем код сами
+        return _referrer_if_valid(await _load_valid_code(db, code))
+
+    load = asyncio.get_running_loop().create_future()
+    _valid_code_loads[code] = load
+    try:
+        entry = await _load_valid_code(db, code)
+    except BaseException:
+        load.set_result(UNAVAILABLE)
+        raise
+    else:
+        load.set_result(entry)
+    finally:
+        _valid_code_loads.pop(code, None)
+    return _referrer_if_valid(entry)
+
+
+async def cache_valid_code(code: str, user_id: int, expiration_date: datetime) -> None:
+    # Только что созданный код сразу кладётся в кеши, чтобы первая волна регистраций не шла в базу
+    entry = _valid_code_entry(user_id, expiration_date)
+    ttl = _ttl_until(expiration_date)
+    valid_code_cache.set(code, entry, ttl)
+    if ttl > 0:
+        await redis_call(lambda r: r.setex(valid_code_key(code), ttl, orjson.dumps(entry)))
+
+
+async def invalidate_valid_codes(codes: Iterable[str]) -> None:
+    codes = list(codes)
+    for code in codes:
+        valid_code_cache.pop(code)
+    await _invalidate([valid_code_key(code) for code in codes])
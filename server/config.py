@@ -0,0 +1,115 @@
+import os
+from dotenv import load_dotenv
+
+load_dotenv()
+
+
+# Приводим URL из окружения к асинхронному драйверу (docker-compose передаёт обычный postgresql://).
+# Поддерживаются PostgreSQL (asyncpg) и SQLite (aiosqlite): sqlite:///app.db, sqlite:///:memory:
+def _async_database_url(url: str) -> str:
+    if url.startswith("postgresql://"):
+        return url.replace("postgresql://", "postgresql+asyncpg://", 1)
+    if url.startswith("sqlite://"):
+        return url.replace("sqlite://", "sqlite+aiosqlite://", 1)
+    return url
+
+
+DATABASE_URL = _async_database_url(
+    os.getenv("DATABASE_URL", "postgresql://postgres:postgres@db:5432/stakewolle")
+)
+
+# Настройки пула соединений с базой данных
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "10"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "20"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))
+# SQLite: сколько миллисекунд ждать блокировку записи и размер кеша страниц в КиБ
+SQLITE_BUSY_TIMEOUT = int(os.getenv("SQLITE_BUSY_TIMEOUT", "5000"))
+SQLITE_CACHE_SIZE_KB = int(os.getenv("SQLITE_CACHE_SIZE_KB", "65536"))
+# Сколько соединений открыть при старте воркера, чтобы первые запросы не ждали подключения
+DB_POOL_WARM = int(os.getenv("DB_POOL_WARM", str(DB_POOL_SIZE)))
+
+# Пул для вычисления bcrypt: "thread" или "process", число воркеров и длина очереди ожидания
+HASH_EXECUTOR = os.getenv("HASH_EXECUTOR", "thread")
+HASH_WORKERS = int(os.getenv("HASH_WORKERS", str(os.cpu_count() or 1)))
+HASH_QUEUE_SIZE = int(os.getenv("HASH_QUEUE_SIZE", "64"))
+# Стоимость bcrypt (log2 числа раундов); хеши со старой стоимостью пересчитываются при входе
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", "12"))
+
+# Кеш реферальных кодов: максимальный TTL записи и TTL отрицательного результата (в секундах).
+# TTL записи ограничивает, сколько удалённый код может прожить в кеше, если его сброс не дошёл до Redis
+REFERRAL_CODE_CACHE_TTL = int(os.getenv("REFERRAL_CODE_CACHE_TTL", "30"))
+REFERRAL_CODE_NEGATIVE_TTL = int(os.getenv("REFERRAL_CODE_NEGATIVE_TTL", "30"))
+# Сколько секунд после изменения кода ключ кеша не заполняется результатами чтений, начатых до изменения
+REFERRAL_CODE_INVALIDATION_TTL = int(os.getenv("REFERRAL_CODE_INVALIDATION_TTL", "10"))
+
+# Подключение к Redis
+REDIS_URL = os.getenv("REDIS_URL", "redis://redis:6379/0")
+REDIS_MAX_CONNECTIONS = int(os.getenv("REDIS_MAX_CONNECTIONS", "50"))
+REDIS_SOCKET_TIMEOUT = float(os.getenv("REDIS_SOCKET_TIMEOUT", "0.5"))
+# Сколько секунд не обращаться к Redis после ошибки соединения (запросы идут напрямую в базу)
+REDIS_RETRY_INTERVAL = float(os.getenv("REDIS_RETRY_INTERVAL", "5"))
+# Сколько раз повторить сброс ключей кеша после ошибки Redis
+REDIS_INVALIDATION_RETRIES = int(os.getenv("REDIS_INVALIDATION_RETRIES", "2"))
+REDIS_POOL_WARM = int(os.getenv("REDIS_POOL_WARM", "4"))
+
+# Аутентификация: "strict" проверяет пользователя в базе на каждый запрос,
+# "stateless" доверяет подписанному токену и сверяет его версию с копией в Redis
+AUTH_MODE = os.getenv("AUTH_MODE", "strict")
+ACCESS_TOKEN_EXPIRE_HOURS = int(os.getenv("ACCESS_TOKEN_EXPIRE_HOURS", "24"))
+# Сколько секунд версия токенов пользователя хранится в Redis (режим stateless)
+AUTH_USER_CACHE_TTL = int(os.getenv("AUTH_USER_CACHE_TTL", "60"))
+
+# Пагинация списка рефералов
+REFERRALS_PAGE_SIZE = int(os.getenv("REFERRALS_PAGE_SIZE", "100"))
+REFERRALS_MAX_PAGE_SIZE = int(os.getenv("REFERRALS_MAX_PAGE_SIZE", "1000"))
+REFERRALS_EXPORT_BATCH_SIZE = int(os.getenv("REFERRALS_EXPORT_BATCH_SIZE", "1000"))
+
+# Дерево рефералов: ограничения рекурсивного запроса и TTL кеша сводки
+REFERRAL_TREE_MAX_DEPTH = int(os.getenv("REFERRAL_TREE_MAX_DEPTH", "10"))
+REFERRAL_TREE_MAX_NODES = int(os.getenv("REFERRAL_TREE_MAX_NODES", "100000"))
+REFERRAL_TREE_CACHE_TTL = int(os.getenv("REFERRAL_TREE_CACHE_TTL", "300"))
+
+# Массовый импорт: токен администратора (заголовок X-Admin-Token) и размер пачки INSERT
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN")
+BULK_BATCH_SIZE = int(os.getenv("BULK_BATCH_SIZE", "1000"))
+BULK_HASH_CHUNK_SIZE = int(os.getenv("BULK_HASH_CHUNK_SIZE", "32"))
+# Сколько воркеров bcrypt может занять массовый импорт; по умолчанию один остаётся для входа и регистрации
+BULK_HASH_WORKERS = int(os.getenv("BULK_HASH_WORKERS", str(max(1, HASH_WORKERS - 1))))
+
+# Очистка истёкших реферальных кодов: "lifespan" — фоновая задача в приложении, "off" — только CLI
+SWEEPER_MODE = os.getenv("SWEEPER_MODE", "lifespan")
+SWEEPER_INTERVAL = float(os.getenv("SWEEPER_INTERVAL", "60"))
+SWEEPER_BATCH_SIZE = int(os.getenv("SWEEPER_BATCH_SIZE", "1000"))
+# Пауза между пачками удаления в секундах, чтобы очистка не вытесняла рабочую нагрузку
+SWEEPER_BATCH_PAUSE = float(os.getenv("SWEEPER_BATCH_PAUSE", "0.1"))
+SWEEPER_RETENTION_HOURS = float(os.getenv("SWEEPER_RETENTION_HOURS", "0"))
+
+# Outbox событий: "lifespan" — доставка в Redis Stream фоновой задачей приложения,
+# "off" — отдельным воркером (python -m server.outbox dispatch)
+OUTBOX_MODE = os.getenv("OUTBOX_MODE", "lifespan")
+OUTBOX_POLL_INTERVAL = float(os.getenv("OUTBOX_POLL_INTERVAL", "1"))
+OUTBOX_BATCH_SIZE = int(os.getenv("OUTBOX_BATCH_SIZE", "500"))
+OUTBOX_MAX_BACKOFF = float(os.getenv("OUTBOX_MAX_BACKOFF", "300"))
+OUTBOX_STREAM = os.getenv("OUTBOX_STREAM", "events")
+OUTBOX_STREAM_MAXLEN = int(os.getenv("OUTBOX_STREAM_MAXLEN", "1000000"))
+# Сколько секунд потребитель помнит обработанные события (ключ идемпотентности)
+OUTBOX_IDEMPOTENCY_TTL = int(os.getenv("OUTBOX_IDEMPOTENCY_TTL", str(7 * 24 * 3600)))
+
+# Локальный (in-process) кеш проверки реферальных кодов для всплесков регистраций
+REFERRAL_CODE_LOCAL_CACHE_SIZE = int(os.getenv("REFERRAL_CODE_LOCAL_CACHE_SIZE", "10000"))
+REFERRAL_CODE_LOCAL_TTL = float(os.getenv("REFERRAL_CODE_LOCAL_TTL", "5"))
+
+# Ограничение частоты запросов "количество/секунды"; пустое значение отключает правило
+RATE_LIMIT_LOGIN_IP = os.getenv("RATE_LIMIT_LOGIN_IP", "30/60")
+RATE_LIMIT_LOGIN_EMAIL = os.getenv("RATE_LIMIT_LOGIN_EMAIL", "10/300")
+RATE_LIMIT_REGISTER_IP = os.getenv("RATE_LIMIT_REGISTER_IP", "10/60")
+RATE_LIMIT_REGISTER_EMAIL = os.getenv("RATE_LIMIT_REGISTER_EMAIL", "5/300")
+
+# Каталог для метрик нескольких воркеров gunicorn (задаётся в gunicorn.conf.py)
+PROMETHEUS_MULTIPROC_DIR = os.getenv("PROMETHEUS_MULTIPROC_DIR")
+
+# Бюджет SQL-запросов на HTTP-запрос для разработки и тестов: "off", "log" — предупреждение
+# в лог, "raise" — исключение. Бюджеты объявляются у эндпоинтов, остальным достаётся значение по умолчанию
+QUERY_BUDGET_MODE = os.getenv("QUERY_BUDGET_MODE", "off")
+QUERY_BUDGET_DEFAULT = int(os.getenv("QUERY_BUDGET_DEFAULT", "10"))
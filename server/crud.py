@@ -1,145 +1,363 @@
-from fastapi import HTTPException, Depends
-from fastapi.security import OAuth2PasswordBearer
-from passlib.hash import bcrypt
-import jwt
+from fastapi import HTTPException
+from collections import Counter
 from datetime import datetime, timedelta
 import os
+import uuid
 from dotenv import load_dotenv
-from passlib.context import CryptContext
-from .models import User, ReferralCode
-from sqlalchemy.orm import Session
-from typing import Optional
-from .database import get_db
-from jose import JWTError, jwt
+from .models import User, ReferralCode, ReferralStats, ReferralDailyStats, ReferralCodeStats, OutboxEvent
+from .database import insert
+from .schemas import normalize_email
+from sqlalchemy import select, func, literal, exists, update, case, or_, bindparam, Integer
+from sqlalchemy.dialects.postgresql import ARRAY
+from sqlalchemy.ext.asyncio import AsyncSession
+from typing import Iterable, Optional, Tuple
+from .hashing import hashing_pool, hash_password_sync, verify_password_sync, verify_and_update_sync, \
+    dummy_verify_sync
+from .metrics import HASH_REHASHED
+from jose import jwt
+from .config import ACCESS_TOKEN_EXPIRE_HOURS
 
 load_dotenv()
 SECRET_KEY = os.getenv("SECRET_KEY")
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 ALGORITHM = "HS256"
-oauth2_scheme = OAuth2PasswordBearer(tokenUrl="auth/login")
+# Тип события outbox о регистрации пользователя
+USER_REGISTERED = "user.registered"
+# Пространство имён advisory-блокировок создания реферальных кодов (второй ключ — user_id)
+REFERRAL_CODE_LOCK_NAMESPACE = 1
 
 
-# Функция для получения текущего пользователя
-def get_current_user(db: Session = Depends(get_db), token: str = Depends(oauth2_scheme)):
-    """
-    Извлекает и проверяет JWT токен, возвращает текущего пользователя.
-    """
-    credentials_exception = HTTPException(
-        status_code=401,
-        detail="Could not validate credentials",
-        headers={"WWW-Authenticate": "Bearer"},
-    )
-
-    try:
-        # Декодируем токен
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        user_id: int = payload.get("user_id")
-        if user_id is None:
-            raise credentials_exception
-    except JWTError:
-        raise credentials_exception
-
-    # Получаем пользователя из базы данных
-    user = db.query(User).filter(User.id == user_id).first()
-    if user is None:
-        raise credentials_exception
-
-    return user
-
-
-# Функция для хеширования пароля
-def password_hash(password: str) -> str:
-    return bcrypt.hash(password)
+# Функция для хеширования пароля (bcrypt выполняется в пуле, не блокируя event loop)
+async def password_hash(password: str) -> str:
+    return await hashing_pool.run("hash", hash_password_sync, password)
 
 
 # Функция для генерации JWT токена
-def create_jwt_token(user_id: int, email: str) -> str:
+def create_jwt_token(user_id: int, email: str, token_version: int = 0) -> str:
     payload = {
         "user_id": user_id,
         "email": email,
-        "exp": datetime.utcnow() + timedelta(hours=24)  # токен на 24 часа
+        "ver": token_version,
+        "exp": datetime.utcnow() + timedelta(hours=ACCESS_TOKEN_EXPIRE_HOURS)  # по умолчанию токен на 24 часа
     }
-    return jwt.encode(payload, SECRET_KEY, algorithm="HS256")
+    return jwt.encode(payload, SECRET_KEY, algorithm=ALGORITHM)
 
 
 # Функция для проверки пароля
-def verify_password(plain_password: str, password_hash: str) -> bool:
-    return pwd_context.verify(plain_password, password_hash)
+async def verify_password(plain_password: str, password_hash: str) -> bool:
+    return await hashing_pool.run("verify", verify_password_sync, plain_password, password_hash)
 
 
 # Функция для получения пользователя по email
-def get_user_by_email(db: Session, email: str) -> Optional[User]:
-    return db.query(User).filter(User.email == email).first()
+async def get_user_by_email(db: AsyncSession, email: str) -> Optional[User]:
+    # Условие совпадает с выражением индекса ix_users_email_lower
+    result = await db.execute(select(User).where(func.lower(User.email) == normalize_email(email)))
+    return result.scalar_one_or_none()
+
+
+async def authenticate_user(db: AsyncSession, email: str, password: str) -> Optional[User]:
+    """
+    Проверяет email и пароль за одинаковое время независимо от существования
+    пользователя: для неизвестного email выполняется bcrypt против фиктивного хеша.
+    Хеш с устаревшей стоимостью пересчитывается после успешной проверки.
+    """
+    user = await get_user_by_email(db, email)
+    if not user:
+        await hashing_pool.run("verify", dummy_verify_sync)
+        return None
+
+    valid, new_hash = await hashing_pool.run("verify", verify_and_update_sync, password, user.password_hash)
+    if not valid:
+        return None
+
+    if new_hash:
+        # Условие на старый хеш: параллельный вход или смена пароля не перезаписываются
+        await db.execute(
+            update(User)
+            .where(User.id == user.id, User.password_hash == user.password_hash)
+            .values(password_hash=new_hash)
+        )
+        await db.commit()
+        HASH_REHASHED.inc()
+    return user
 
 
-def get_active_referral_code(db: Session, user_id: int):
+async def get_active_referral_code(db: AsyncSession, user_id: int):
     # Проверка, есть ли у пользователя активный реферальный код
-    return db.query(ReferralCode).filter(
+    result = await db.execute(select(ReferralCode).where(
         ReferralCode.user_id == user_id,
         ReferralCode.expiration_date > datetime.utcnow()
-    ).first()
+    ).limit(1))
+    return result.scalar_one_or_none()
 
 
-def create_referral_code(db: Session, user_id: int, code: str, expiration_date: datetime):
-    # Проверка на наличие активного реферального кода
-    active_code = get_active_referral_code(db, user_id)
-    if active_code:
-        raise HTTPException(status_code=400, detail="У пользователя уже есть активный реферальный код")
+async def lock_referral_code_users(db: AsyncSession, user_ids: Iterable[int]) -> None:
+    """
+    Сериализует создание кодов для указанных пользователей advisory-блокировками
+    транзакции (только PostgreSQL). Блокировки берутся по возрастанию user_id,
+    поэтому пачки массового импорта не ждут друг друга по кругу. В SQLite
+    запись и так выполняется одним писателем за раз, и блокировка не нужна.
+    """
+    user_ids = sorted(set(user_ids))
+    if db.bind.dialect.name != "postgresql" or not user_ids:
+        return
+    locked = func.unnest(bindparam("user_ids", user_ids, type_=ARRAY(Integer))).column_valued("user_id")
+    await db.execute(select(func.pg_advisory_xact_lock(REFERRAL_CODE_LOCK_NAMESPACE, locked)))
+
+
+def insert_referral_code_if_no_active(code, expiration_date, user_id):
+    """
+    INSERT ... SELECT ... WHERE NOT EXISTS: код вставляется, только если он уже
+    истёк или у пользователя нет активного кода. Значения — literal() для
+    одного кода или bindparam() для executemany при массовом импорте.
+    """
+    now = datetime.utcnow()
+    active_code = select(ReferralCode.id).where(
+        ReferralCode.user_id == user_id,
+        ReferralCode.expiration_date > now
+    )
+    return (
+        insert(ReferralCode)
+        .from_select(
+            ["code", "expiration_date", "user_id"],
+            select(code, expiration_date, user_id).where(or_(expiration_date <= now, ~exists(active_code)))
+        )
+        .on_conflict_do_nothing(index_elements=[ReferralCode.code])
+    )
+
 
-    # Создание нового реферального кода
-    new_code = ReferralCode(
-        code=code,
-        expiration_date=expiration_date,
-        user_id=user_id
+async def create_referral_code(db: AsyncSession, user_id: int, code: str, expiration_date: datetime):
+    """
+    Создаёт код, только если у пользователя нет активного. Проверка и вставка
+    выполняются одним INSERT ... SELECT ... WHERE NOT EXISTS, а одновременные
+    вызовы для одного пользователя сериализуются блокировкой, поэтому два
+    активных кода появиться не могут.
+    """
+    await lock_referral_code_users(db, [user_id])
+    result = await db.execute(
+        insert_referral_code_if_no_active(literal(code), literal(expiration_date), literal(user_id))
+        .returning(ReferralCode.id, ReferralCode.code, ReferralCode.expiration_date)
     )
-    db.add(new_code)
-    db.commit()
-    db.refresh(new_code)
+    new_code = result.first()
+    await db.commit()
+    if new_code is None:
+        # Причина отказа выясняется только в редком случае неудачи
+        if await get_active_referral_code(db, user_id):
+            raise HTTPException(status_code=400, detail="У пользователя уже есть активный реферальный код")
+        raise HTTPException(status_code=400, detail="Такой реферальный код уже существует")
     return new_code
 
 
-def delete_referral_code(db: Session, user_id: int):
+async def delete_referral_code(db: AsyncSession, user_id: int):
     # Находим активный реферальный код пользователя
-    active_code = get_active_referral_code(db, user_id)
+    active_code = await get_active_referral_code(db, user_id)
     if not active_code:
         raise HTTPException(status_code=404, detail="Нет активного реферального кода")
 
-    # Удаляем реферальный код
-    db.delete(active_code)
-    db.commit()
-    return {"message": "Реферальный код успешно удалён"}
+    # Удаляем реферальный код и возвращаем его значение для сброса кешей
+    await db.delete(active_code)
+    await db.commit()
+    return active_code.code
 
 
-def get_referral_code_by_email(db: Session, email: str):
-    # Найти пользователя по email
-    user = db.query(User).filter(User.email == email).first()
-    if not user:
-        return None  # Если пользователя нет, возвращаем None
-
-    # Найти активный реферальный код для найденного пользователя
-    referral_code = db.query(ReferralCode).filter(ReferralCode.user_id == user.id).first()
-    return referral_code
+async def get_referral_code_by_email(db: AsyncSession, email: str):
+    # Активный реферальный код пользователя одним запросом users ⋈ referral_codes
+    result = await db.execute(
+        select(ReferralCode.code, ReferralCode.expiration_date)
+        .join(User, User.id == ReferralCode.user_id)
+        .where(func.lower(User.email) == normalize_email(email), ReferralCode.expiration_date > datetime.utcnow())
+        .limit(1)
+    )
+    return result.first()
 
 
-def get_valid_referral_code(db: Session, code: str) -> ReferralCode:
-    return db.query(ReferralCode).filter(
+async def get_valid_referral_code(db: AsyncSession, code: str) -> Optional[ReferralCode]:
+    result = await db.execute(select(ReferralCode).where(
         ReferralCode.code == code,
         ReferralCode.expiration_date >= datetime.utcnow()
-    ).first()
+    ))
+    return result.scalar_one_or_none()
+
 
+async def record_referral_signups(db: AsyncSession, signups: Iterable[Tuple[int, Optional[str], datetime]]) -> None:
+    """
+    Увеличивает счётчики аналитики для регистраций (referrer_id, код, время).
+    Вызывается в транзакции, создающей пользователей, поэтому счётчики
+    фиксируются вместе с ними; несколько регистраций сворачиваются в одно
+    обновление на строку счётчика.
+    """
+    totals, last_signup, daily, codes = Counter(), {}, Counter(), Counter()
+    for referrer_id, code, created_at in signups:
+        totals[referrer_id] += 1
+        last_signup[referrer_id] = max(created_at, last_signup.get(referrer_id, created_at))
+        daily[(referrer_id, created_at.date())] += 1
+        if code:
+            codes[(referrer_id, code)] += 1
+    if not totals:
+        return
+
+    statement = insert(ReferralStats).values([
+        {"referrer_id": referrer_id, "total": count, "last_signup_at": last_signup[referrer_id]}
+        for referrer_id, count in sorted(totals.items())
+    ])
+    await db.execute(statement.on_conflict_do_update(
+        index_elements=[ReferralStats.referrer_id],
+        set_={
+            "total": ReferralStats.total + statement.excluded.total,
+            # Наибольшее из значений; CASE вместо GREATEST работает и в SQLite
+            "last_signup_at": case(
+                (ReferralStats.last_signup_at >= statement.excluded.last_signup_at, ReferralStats.last_signup_at),
+                else_=statement.excluded.last_signup_at,
+            ),
+        },
+    ))
+
+    statement = insert(ReferralDailyStats).values([
+        {"referrer_id": referrer_id, "day": day, "signups": count}
+        for (referrer_id, day), count in sorted(daily.items())
+    ])
+    await db.execute(statement.on_conflict_do_update(
+        index_elements=[ReferralDailyStats.referrer_id, ReferralDailyStats.day],
+        set_={"signups": ReferralDailyStats.signups + statement.excluded.signups},
+    ))
+
+    if codes:
+        statement = insert(ReferralCodeStats).values([
+            {"referrer_id": referrer_id, "code": code, "signups": count}
+            for (referrer_id, code), count in sorted(codes.items())
+        ])
+        await db.execute(statement.on_conflict_do_update(
+            index_elements=[ReferralCodeStats.referrer_id, ReferralCodeStats.code],
+            set_={"signups": ReferralCodeStats.signups + statement.excluded.signups},
+        ))
 
-def create_user_with_referral(db: Session, email: str, password: str, referrer_id: Optional[int] = None) -> User:
-    new_user = User(
-        email=email,
-        password_hash=password_hash(password),
-        referrer_id=referrer_id  # Указание реферера
+
+def user_registered_event(user_id: int, email: str, referrer_id: Optional[int], referral_code: Optional[str],
+                          created_at: datetime) -> Tuple[str, dict]:
+    return USER_REGISTERED, {
+        "user_id": user_id,
+        "email": email,
+        "referrer_id": referrer_id,
+        "referral_code": referral_code,
+        "created_at": created_at.isoformat(),
+    }
+
+
+async def add_outbox_events(db: AsyncSession, events: Iterable[Tuple[str, dict]]) -> None:
+    # Только INSERT в текущей транзакции: доставкой занимается диспетчер (server/outbox.py)
+    values = [{"event_id": str(uuid.uuid4()), "event_type": event_type, "payload": payload}
+              for event_type, payload in events]
+    if values:
+        await db.execute(insert(OutboxEvent).values(values))
+
+
+async def get_referral_stats(db: AsyncSession, referrer_id: int, days: int) -> Optional[dict]:
+    # Три чтения по первичным ключам счётчиков, без обращения к users
+    stats = await db.get(ReferralStats, referrer_id)
+    if stats is None:
+        return None
+    since = datetime.utcnow().date() - timedelta(days=days - 1)
+    daily = await db.execute(
+        select(ReferralDailyStats.day, ReferralDailyStats.signups)
+        .where(ReferralDailyStats.referrer_id == referrer_id, ReferralDailyStats.day >= since)
+        .order_by(ReferralDailyStats.day)
     )
-    db.add(new_user)
-    db.commit()
-    db.refresh(new_user)
-    return new_user
+    codes = await db.execute(
+        select(ReferralCodeStats.code, ReferralCodeStats.signups)
+        .where(ReferralCodeStats.referrer_id == referrer_id)
+        .order_by(ReferralCodeStats.signups.desc(), ReferralCodeStats.code)
+    )
+    return {
+        "referrer_id": referrer_id,
+        "total": stats.total,
+        "last_signup_at": stats.last_signup_at,
+        "daily": [{"day": day, "signups": signups} for day, signups in daily.all()],
+        "codes": [{"code": code, "signups": signups} for code, signups in codes.all()],
+    }
 
 
-def get_referrals_by_referrer_id(db: Session, referrer_id: int):
-    referrals = db.query(User).filter(User.referrer_id == referrer_id).all()
-    return referrals
+async def create_user_with_referral(db: AsyncSession, email: str, password: str, referrer_id: Optional[int] = None,
+                                    referral_code: Optional[str] = None) -> int:
+    """
+    Создаёт пользователя одним INSERT ... ON CONFLICT DO NOTHING RETURNING id.
+    Занятый email определяется уникальным индексом, поэтому одновременные
+    регистрации с одним email не могут пройти обе. Счётчики аналитики
+    реферера обновляются в той же транзакции.
+    """
+    created_at = datetime.utcnow()
+    result = await db.execute(
+        insert(User)
+        .values(
+            email=email,
+            password_hash=await password_hash(password),
+            referrer_id=referrer_id,  # Указание реферера
+            referral_code=referral_code if referrer_id is not None else None,
+            created_at=created_at
+        )
+        .on_conflict_do_nothing(index_elements=[func.lower(User.email)])
+        .returning(User.id)
+    )
+    user_id = result.scalar_one_or_none()
+    if user_id is not None:
+        # Событие фиксируется вместе с пользователем; побочные эффекты выполняются потребителями потока
+        await add_outbox_events(db, [user_registered_event(user_id, email, referrer_id, referral_code, created_at)])
+        if referrer_id is not None:
+            await record_referral_signups(db, [(referrer_id, referral_code, created_at)])
+    await db.commit()
+    if user_id is None:
+        raise HTTPException(status_code=400, detail="Email уже зарегистрирован")
+    return user_id
+
+
+async def get_referrals_by_referrer_id(db: AsyncSession, referrer_id: int, limit: int, after_id: Optional[int] = None):
+    # Keyset-пагинация: следующая страница начинается после последнего полученного id.
+    # Выбираются только отдаваемые колонки — строки, без создания ORM-объектов
+    query = select(User.id, User.email, User.referrer_id).where(User.referrer_id == referrer_id)
+    if after_id is not None:
+        query = query.where(User.id > after_id)
+    result = await db.execute(query.order_by(User.id).limit(limit))
+    return result.all()
+
+
+async def count_referrals(db: AsyncSession, referrer_id: int) -> int:
+    # Считается по индексу ix_users_referrer_id_id без чтения строк
+    result = await db.execute(select(func.count()).select_from(User).where(User.referrer_id == referrer_id))
+    return result.scalar_one()
+
+
+async def get_referral_tree_levels(db: AsyncSession, referrer_id: int, max_depth: int, max_nodes: int):
+    """
+    Считает рефералов всех уровней одним рекурсивным запросом (WITH RECURSIVE).
+    Возвращает список (уровень, количество); обход ограничен max_depth уровнями
+    и max_nodes + 1 узлами, чтобы по лишнему узлу можно было понять, что дерево обрезано.
+    """
+    tree = (
+        select(User.id, literal(1).label("depth"))
+        .where(User.referrer_id == referrer_id)
+        .cte("referral_tree", recursive=True)
+    )
+    tree = tree.union_all(
+        select(User.id, (tree.c.depth + 1).label("depth"))
+        .join(tree, User.referrer_id == tree.c.id)
+        .where(tree.c.depth < max_depth)
+    )
+    nodes = select(tree.c.depth).limit(max_nodes + 1).subquery()
+    result = await db.execute(
+        select(nodes.c.depth, func.count()).group_by(nodes.c.depth).order_by(nodes.c.depth)
+    )
+    return result.all()
+
+
+async def get_referrer_chain(db: AsyncSession, referrer_id: int, max_depth: int):
+    # id реферера и его предков до max_depth уровней вверх — чьи деревья меняет новый реферал
+    chain = (
+        select(User.id, User.referrer_id, literal(1).label("depth"))
+        .where(User.id == referrer_id)
+        .cte("referrer_chain", recursive=True)
+    )
+    chain = chain.union_all(
+        select(User.id, User.referrer_id, (chain.c.depth + 1).label("depth"))
+        .join(chain, User.id == chain.c.referrer_id)
+        .where(chain.c.depth < max_depth)
+    )
+    result = await db.execute(select(chain.c.id))
+    return result.scalars().all()
@@ -1,18 +1,109 @@
+import asyncio
+import logging
+import time
+
+from sqlalchemy import event, text
+from sqlalchemy.dialects.postgresql import insert as postgresql_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker
-from sqlalchemy import create_engine
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
+from sqlalchemy.engine import make_url
+from sqlalchemy.pool import AsyncAdaptedQueuePool, StaticPool
+from .config import DATABASE_URL, DB_POOL_SIZE, DB_MAX_OVERFLOW, DB_POOL_TIMEOUT, DB_POOL_RECYCLE, \
+    SQLITE_BUSY_TIMEOUT, SQLITE_CACHE_SIZE_KB
+from .instrumentation import instrument_engine
+from .metrics import DB_POOL_CHECKOUT_WAIT
+
+logger = logging.getLogger(__name__)
+
+
+class TimedAsyncQueuePool(AsyncAdaptedQueuePool):
+    # Пул, измеряющий время ожидания свободного соединения
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            DB_POOL_CHECKOUT_WAIT.observe(time.perf_counter() - start)
+
+
+def is_memory_database(url: str) -> bool:
+    database_url = make_url(url)
+    return database_url.get_backend_name() == "sqlite" and database_url.database in (None, "", ":memory:")
 
-DATABASE_URL = "postgresql://postgres:postgres@db:5432/stakewolle"
-engine = create_engine(DATABASE_URL)
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+def _engine_options(url: str) -> dict:
+    if is_memory_database(url):
+        # База в памяти существует внутри одного соединения, поэтому оно общее для всех сессий:
+        # транзакции одновременных запросов перемешиваются, режим годится только для тестов с одним клиентом
+        return {"poolclass": StaticPool, "connect_args": {"check_same_thread": False}}
+    return {
+        "poolclass": TimedAsyncQueuePool,
+        "pool_size": DB_POOL_SIZE,
+        "max_overflow": DB_MAX_OVERFLOW,
+        "pool_timeout": DB_POOL_TIMEOUT,
+        "pool_recycle": DB_POOL_RECYCLE,
+        "pool_pre_ping": True,
+    }
+
+
+engine = create_async_engine(DATABASE_URL, **_engine_options(DATABASE_URL))
+# expire_on_commit=False: объекты остаются доступными после commit без повторного SELECT
+SessionLocal = async_sessionmaker(bind=engine, class_=AsyncSession, autoflush=False, expire_on_commit=False)
 Base = declarative_base()
 
-Base.metadata.create_all(bind=engine)
+instrument_engine(engine)
 
 
-def get_db():
-    db = SessionLocal()
-    try:
+if engine.dialect.name == "sqlite":
+    @event.listens_for(engine.sync_engine, "connect")
+    def _configure_sqlite(dbapi_connection, connection_record):
+        # WAL: чтение не блокируется записью; synchronous=NORMAL достаточно для WAL и намного быстрее FULL
+        cursor = dbapi_connection.cursor()
+        cursor.execute("PRAGMA journal_mode=WAL")
+        cursor.execute("PRAGMA synchronous=NORMAL")
+        cursor.execute("PRAGMA foreign_keys=ON")
+        cursor.execute(f"PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT}")
+        cursor.execute(f"PRAGMA cache_size=-{SQLITE_CACHE_SIZE_KB}")
+        cursor.execute("PRAGMA temp_store=MEMORY")
+        cursor.close()
+
+
+def insert(table):
+    # INSERT с ON CONFLICT DO NOTHING / DO UPDATE в диалекте текущей базы
+    if engine.dialect.name == "sqlite":
+        return sqlite_insert(table)
+    return postgresql_insert(table)
+
+
+async def create_memory_schema():
+    # Миграции выполняются отдельным процессом и базу в памяти не видят: схема создаётся по моделям
+    if is_memory_database(DATABASE_URL):
+        async with engine.begin() as connection:
+            await connection.run_sync(Base.metadata.create_all)
+
+
+async def get_db():
+    async with SessionLocal() as db:
         yield db
-    finally:
-        db.close()
+
+
+async def warm_up_database(connections: int):
+    # Соединения открываются одновременно и возвращаются в пул; ошибка не мешает старту,
+    # её покажет /health/ready
+    try:
+        opened = await asyncio.gather(*(engine.connect() for _ in range(connections)))
+        for connection in opened:
+            await connection.close()
+    except Exception:
+        logger.warning("Не удалось прогреть пул соединений с базой", exc_info=True)
+
+
+async def check_database() -> bool:
+    try:
+        async with engine.connect() as connection:
+            await connection.execute(text("SELECT 1"))
+        return True
+    except Exception:
+        logger.warning("База данных недоступна", exc_info=True)
+        return False
@@ -0,0 +1,100 @@
+"""
+Приведение сохранённых email к нижнему регистру.
+
+Новые пользователи сохраняются с нормализованным email, поиск идёт по индексу
+ix_users_email_lower. Backfill приводит к нижнему регистру уже сохранённые
+email пачками по id, каждая пачка — отдельная короткая транзакция. Если есть
+email, различающиеся только регистром, backfill не запускается: их нужно
+разрешить вручную.
+
+    python -m server.emails duplicates   # email, различающиеся только регистром
+    python -m server.emails backfill --batch-size 1000
+"""
+import argparse
+import asyncio
+import json
+import sys
+
+from sqlalchemy import func, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from .cache import close_redis, invalidate_referral_codes
+from .database import SessionLocal, engine
+from .models import User
+
+
+class DuplicateEmailsError(RuntimeError):
+    def __init__(self, emails: list):
+        super().__init__(f"Email, различающиеся только регистром: {', '.join(emails)}")
+        self.emails = emails
+
+
+async def find_duplicates(db: AsyncSession) -> list:
+    result = await db.execute(
+        select(func.lower(User.email)).group_by(func.lower(User.email)).having(func.count() > 1)
+    )
+    return result.scalars().all()
+
+
+async def backfill_batch(db: AsyncSession, after_id: int, batch_size: int) -> tuple:
+    """
+    Обрабатывает следующие batch_size пользователей после after_id.
+    Возвращает (последний id пачки или None, число изменённых email).
+    """
+    ids = (await db.execute(
+        select(User.id).where(User.id > after_id).order_by(User.id).limit(batch_size)
+    )).scalars().all()
+    if not ids:
+        return None, 0
+    changed = (await db.execute(
+        update(User)
+        .where(User.id.in_(ids), User.email != func.lower(User.email))
+        .values(email=func.lower(User.email))
+        .returning(User.email)
+    )).scalars().all()
+    await db.commit()
+    # Ключи кеша уже строятся по нормализованному email, но старые записи могли остаться
+    await invalidate_referral_codes(changed)
+    return ids[-1], len(changed)
+
+
+async def backfill(batch_size: int) -> int:
+    # Приведение дубликатов к одному email нарушило бы уникальность: проверяем до изменений
+    async with SessionLocal() as db:
+        duplicates = await find_duplicates(db)
+    if duplicates:
+        raise DuplicateEmailsError(duplicates)
+
+    total = 0
+    after_id = 0
+    while after_id is not None:
+        async with SessionLocal() as db:
+            after_id, changed = await backfill_batch(db, after_id, batch_size)
+        total += changed
+    return total
+
+
+async def _run_cli(args) -> object:
+    try:
+        if args.command == "duplicates":
+            async with SessionLocal() as db:
+                return await find_duplicates(db)
+        return {"updated": await backfill(args.batch_size)}
+    except DuplicateEmailsError as exc:
+        print(json.dumps({"error": str(exc), "duplicates": exc.emails}, ensure_ascii=False), file=sys.stderr)
+        sys.exit(1)
+    finally:
+        await close_redis()
+        await engine.dispose()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("command", choices=["backfill", "duplicates"])
+    parser.add_argument("--batch-size", type=int, default=1000)
+    args = parser.parse_args()
+    print(json.dumps(asyncio.run(_run_cli(args))))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,125 @@
+import asyncio
+import time
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import List, Optional, Tuple
+
+from fastapi import HTTPException
+from passlib.context import CryptContext
+
+from .config import HASH_EXECUTOR, HASH_WORKERS, HASH_QUEUE_SIZE, BCRYPT_ROUNDS
+from .metrics import HASH_QUEUE_DEPTH, HASH_IN_FLIGHT, HASH_LATENCY, HASH_COMPUTE, HASH_REJECTED
+
+# Хеши с другим числом раундов считаются устаревшими (needs_update) и пересчитываются при входе
+pwd_context = CryptContext(
+    schemes=["bcrypt"],
+    deprecated="auto",
+    bcrypt__rounds=BCRYPT_ROUNDS,
+    bcrypt__min_rounds=BCRYPT_ROUNDS,
+    bcrypt__max_rounds=BCRYPT_ROUNDS,
+)
+
+
+# Синхронные функции выполняются внутри пула (для ProcessPoolExecutor они должны быть на уровне модуля)
+def hash_password_sync(password: str) -> str:
+    return pwd_context.hash(password)
+
+
+def verify_password_sync(plain_password: str, password_hash: str) -> bool:
+    return pwd_context.verify(plain_password, password_hash)
+
+
+def verify_and_update_sync(plain_password: str, password_hash: str) -> Tuple[bool, Optional[str]]:
+    # Второй элемент — новый хеш, если старый не соответствует текущей стоимости
+    return pwd_context.verify_and_update(plain_password, password_hash)
+
+
+def dummy_verify_sync() -> bool:
+    # Проверка против фиктивного хеша той же стоимости: неизвестный email стоит столько же, сколько существующий
+    return pwd_context.dummy_verify()
+
+
+def hash_passwords_sync(passwords: List[str]) -> List[str]:
+    # Пачка паролей за одну задачу снижает накладные расходы пула при массовом импорте
+    return [pwd_context.hash(password) for password in passwords]
+
+
+def _timed(func, *args):
+    # Замер внутри воркера: в режиме process метрики родителя недоступны, поэтому время возвращается
+    start = time.perf_counter()
+    result = func(*args)
+    return result, time.perf_counter() - start
+
+
+class HashingPool:
+    """
+    Ограниченный пул для CPU-тяжёлых операций bcrypt.
+
+    Одновременно принимается не более workers + queue_size операций, остальные
+    сразу отклоняются с 503, чтобы всплеск логинов не копил задержку и не
+    блокировал event loop.
+    """
+
+    def __init__(self, kind: str, workers: int, queue_size: int):
+        self.kind = kind
+        self.workers = workers
+        self.limit = workers + queue_size
+        self.pending = 0
+        self._executor: Optional[Executor] = None
+
+    def _get_executor(self) -> Executor:
+        if self._executor is None:
+            if self.kind == "process":
+                self._executor = ProcessPoolExecutor(max_workers=self.workers)
+            else:
+                self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="bcrypt")
+        return self._executor
+
+    def _update_gauges(self):
+        HASH_IN_FLIGHT.set(self.pending)
+        HASH_QUEUE_DEPTH.set(max(0, self.pending - self.workers))
+
+    async def run(self, operation: str, func, *args):
+        if self.pending >= self.limit:
+            HASH_REJECTED.labels(operation).inc()
+            raise HTTPException(
+                status_code=503,
+                detail="Сервис перегружен, повторите попытку позже",
+                headers={"Retry-After": "1"},
+            )
+
+        self.pending += 1
+        self._update_gauges()
+        start = time.perf_counter()
+        try:
+            loop = asyncio.get_running_loop()
+            result, compute_time = await loop.run_in_executor(self._get_executor(), _timed, func, *args)
+            HASH_COMPUTE.labels(operation).observe(compute_time)
+            return result
+        finally:
+            self.pending -= 1
+            self._update_gauges()
+            HASH_LATENCY.labels(operation).observe(time.perf_counter() - start)
+
+    async def run_many(self, operation: str, func, items: list, chunk_size: int, concurrency: int) -> list:
+        """
+        Обрабатывает список пачками по chunk_size; одновременно выполняется не больше
+        concurrency пачек (и не больше, чем воркеров), чтобы массовая операция
+        оставляла свободные воркеры для входа и регистрации.
+        """
+        semaphore = asyncio.Semaphore(max(1, min(concurrency, self.workers)))
+
+        async def run_chunk(chunk):
+            async with semaphore:
+                return await self.run(operation, func, chunk)
+
+        chunks = [items[i:i + chunk_size] for i in range(0, len(items), chunk_size)]
+        results = await asyncio.gather(*(run_chunk(chunk) for chunk in chunks))
+        return [item for chunk in results for item in chunk]
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+
+hashing_pool = HashingPool(HASH_EXECUTOR, HASH_WORKERS, HASH_QUEUE_SIZE)
@@ -0,0 +1,122 @@
+import contextvars
+import logging
+import time
+from collections import Counter
+from dataclasses import dataclass
+from typing import Optional
+
+from sqlalchemy import event
+from sqlalchemy.ext.asyncio import AsyncEngine
+
+from .config import QUERY_BUDGET_MODE, QUERY_BUDGET_DEFAULT
+from .metrics import HTTP_REQUEST_LATENCY, HTTP_REQUEST_DB_QUERIES, HTTP_REQUEST_DB_TIME, DB_QUERY_LATENCY, \
+    QUERY_BUDGET_EXCEEDED
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class RequestStats:
+    queries: int = 0
+    db_time: float = 0.0
+    # Тексты SQL-запросов; собираются только при включённом QUERY_BUDGET_MODE
+    statements: Optional[list] = None
+
+
+class QueryBudgetExceeded(AssertionError):
+    pass
+
+
+def query_budget(limit: Optional[int]):
+    """
+    Объявляет, сколько SQL-запросов допускается на один вызов эндпоинта;
+    None — без ограничения (выгрузки и массовый импорт, где число запросов
+    растёт с объёмом данных). Декоратор ставится под @app.get/@app.post.
+    """
+    def decorator(endpoint):
+        endpoint.query_budget = limit
+        return endpoint
+    return decorator
+
+
+def check_query_budget(route: str, endpoint, stats: RequestStats) -> None:
+    """
+    Сравнивает число SQL-запросов с бюджетом маршрута: при превышении пишет в лог
+    самый частый запрос (типичный признак N+1), а в режиме raise — падает.
+    """
+    budget = getattr(endpoint, "query_budget", QUERY_BUDGET_DEFAULT)
+    if budget is None or stats.queries <= budget:
+        return
+    QUERY_BUDGET_EXCEEDED.labels(route).inc()
+    statement, repeats = Counter(stats.statements).most_common(1)[0]
+    message = (f"{route}: {stats.queries} SQL-запросов при бюджете {budget}; "
+               f"чаще всего ({repeats} раз): {' '.join(statement.split())}")
+    if QUERY_BUDGET_MODE == "raise":
+        raise QueryBudgetExceeded(message)
+    logger.warning(message)
+
+
+# Статистика текущего HTTP-запроса; события SQLAlchemy видят её через contextvars
+request_stats: contextvars.ContextVar = contextvars.ContextVar("request_stats", default=None)
+
+
+def instrument_engine(engine: AsyncEngine) -> None:
+    """
+    Подписывается на события движка: длительность каждого запроса и счётчики
+    текущего HTTP-запроса.
+    """
+    @event.listens_for(engine.sync_engine, "before_cursor_execute")
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("query_start", []).append(time.perf_counter())
+
+    @event.listens_for(engine.sync_engine, "after_cursor_execute")
+    def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        elapsed = time.perf_counter() - conn.info["query_start"].pop()
+        DB_QUERY_LATENCY.observe(elapsed)
+        stats = request_stats.get()
+        if stats is not None:
+            stats.queries += 1
+            stats.db_time += elapsed
+            if stats.statements is not None:
+                stats.statements.append(statement)
+
+
+class PrometheusMiddleware:
+    """
+    ASGI middleware: время ответа по шаблону маршрута и число SQL-запросов на запрос.
+    При QUERY_BUDGET_MODE=log|raise проверяет бюджет запросов маршрута.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        status_code = 500
+        stats = RequestStats(statements=[] if QUERY_BUDGET_MODE != "off" else None)
+        token = request_stats.set(stats)
+
+        async def send_wrapper(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            request_stats.reset(token)
+            # Шаблон пути (/referrals/{referrer_id}), а не сам путь, чтобы не плодить метки
+            route = getattr(scope.get("route"), "path", "unmatched")
+            if route != "/metrics":
+                HTTP_REQUEST_LATENCY.labels(scope["method"], route, str(status_code)).observe(
+                    time.perf_counter() - start
+                )
+                HTTP_REQUEST_DB_QUERIES.labels(route).observe(stats.queries)
+                HTTP_REQUEST_DB_TIME.labels(route).observe(stats.db_time)
+                if stats.statements is not None:
+                    check_query_budget(route, scope.get("endpoint"), stats)
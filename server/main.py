@@ -1,22 +1,60 @@
-import json
-import redis
-from typing import List
+import asyncio
+from contextlib import asynccontextmanager, suppress
+from typing import List, Optional
 from fastapi.openapi.utils import get_openapi
-from fastapi import FastAPI, HTTPException, Depends
+from fastapi import FastAPI, HTTPException, Depends, Query, Request, Response
+from fastapi.responses import ORJSONResponse, StreamingResponse
+import orjson
+from prometheus_client import CONTENT_TYPE_LATEST, CollectorRegistry, generate_latest, multiprocess
 from .schemas import RegisterRequest, LoginRequest, Token, ReferralCodeCreate, ReferralCodeResponse, \
-    RegisterWithReferralCodeRequest, UserBase, ReferralCode
-from .models import User
-from .database import SessionLocal, get_db
-from .crud import password_hash, create_jwt_token, verify_password, get_user_by_email, create_referral_code, \
-    delete_referral_code, get_current_user, get_valid_referral_code, \
-    create_user_with_referral, get_referrals_by_referrer_id
-from sqlalchemy.orm import Session
+    RegisterWithReferralCodeRequest, UserBase, ReferralCode, CurrentUser, ReferralTreeSummary, BulkImportResult, \
+    ReferralStats
+from .config import REFERRALS_PAGE_SIZE, REFERRALS_MAX_PAGE_SIZE, REFERRALS_EXPORT_BATCH_SIZE, REFERRAL_TREE_MAX_DEPTH, \
+    SWEEPER_MODE, OUTBOX_MODE, DB_POOL_WARM, REDIS_POOL_WARM, PROMETHEUS_MULTIPROC_DIR
+from .database import SessionLocal, engine, get_db, warm_up_database, check_database, create_memory_schema
+from .hashing import hashing_pool
+from .instrumentation import PrometheusMiddleware, query_budget
+from .auth import get_current_user, require_admin_token, revoke_user
+from .bulk import parse_rows, import_users, import_referral_codes
+from .sweeper import run_sweeper
+from .outbox import run_dispatcher
+from .ratelimit import enforce_rate_limits, client_ip, LOGIN_IP, LOGIN_EMAIL, REGISTER_IP, REGISTER_EMAIL
+from .cache import get_referral_code_cached, cache_referral_code, invalidate_referral_codes, close_redis, \
+    warm_up_redis, ping_redis, \
+    get_referral_tree_cached, invalidate_referral_trees, get_referrer_by_code_cached, invalidate_valid_codes, \
+    cache_valid_code
+from .crud import create_jwt_token, authenticate_user, create_referral_code, \
+    delete_referral_code, \
+    create_user_with_referral, get_referrals_by_referrer_id, count_referrals, get_referrer_chain, get_referral_stats
+from sqlalchemy.ext.asyncio import AsyncSession
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Пулы создаются в каждом воркере после fork; прогреваем их до приёма трафика
+    await create_memory_schema()
+    await warm_up_database(DB_POOL_WARM)
+    await warm_up_redis(REDIS_POOL_WARM)
+    # Фоновая очистка истёкших реферальных кодов
+    sweeper_task = asyncio.create_task(run_sweeper()) if SWEEPER_MODE == "lifespan" else None
+    # Доставка событий outbox в Redis Stream
+    outbox_task = asyncio.create_task(run_dispatcher()) if OUTBOX_MODE == "lifespan" else None
+    yield
+    for task in (sweeper_task, outbox_task):
+        if task is not None:
+            task.cancel()
+            with suppress(asyncio.CancelledError):
+                await task
+    # Останавливаем пул bcrypt и закрываем соединения с Redis и базой при завершении приложения
+    hashing_pool.shutdown()
+    await close_redis()
+    await engine.dispose()
 
-# Инициализация FastAPI
-app = FastAPI()
 
-# Подключение к Redis
-redis_client = redis.StrictRedis(host='redis', port=6379, db=0)
+# Инициализация FastAPI
+# orjson сериализует ответы в разы быстрее стандартного json
+app = FastAPI(lifespan=lifespan, default_response_class=ORJSONResponse)
+app.add_middleware(PrometheusMiddleware)
 
 
 # Кастомное OpenAPI
@@ -36,40 +74,65 @@ def custom_openapi():
 app.openapi = custom_openapi
 
 
+@app.get("/metrics", include_in_schema=False)
+async def metrics():
+    # Метрики в формате Prometheus; под gunicorn собираются со всех воркеров
+    if PROMETHEUS_MULTIPROC_DIR:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return Response(content=generate_latest(registry), media_type=CONTENT_TYPE_LATEST)
+    return Response(content=generate_latest(), media_type=CONTENT_TYPE_LATEST)
+
+
+@app.get("/health/live", tags=["Health"], summary="Проверка, что процесс жив")
+@query_budget(0)
+async def health_live():
+    # Не обращается к внешним сервисам: перезапуск воркера не поможет при недоступной базе
+    return {"status": "ok"}
+
+
+@app.get("/health/ready", tags=["Health"], summary="Готовность принимать трафик")
+@query_budget(1)
+async def health_ready(response: Response):
+    # Без базы сервис не работает; без Redis работает медленнее, поэтому он только отображается
+    database = await check_database()
+    redis = await ping_redis()
+    if not database:
+        response.status_code = 503
+    return {"status": "ok" if database else "unavailable", "database": database, "redis": redis}
+
+
 # Endpoint для регистрации пользователя
 @app.post("/auth/register", tags=["Authentication"], summary="Регистрация пользователя")
-async def register_user(request: RegisterRequest):
+@query_budget(2)
+async def register_user(request: RegisterRequest, http_request: Request, db: AsyncSession = Depends(get_db)):
     """
     Регистрирует нового пользователя.
 
     - **email**: Электронная почта пользователя.
     - **password**: Пароль пользователя.
     """
-    session = SessionLocal()
-    user = session.query(User).filter(User.email == request.email).first()
-
-    if user:
-        raise HTTPException(status_code=400, detail="Email уже зарегистрирован")
-
-    # Хешируем пароль и создаем пользователя
-    new_user = User(
-        email=request.email,
-        password_hash=password_hash(request.password)
+    # Лимиты по адресу и по email проверяются до хеширования пароля и обращения к базе
+    await enforce_rate_limits(
+        (REGISTER_IP, client_ip(http_request)),
+        (REGISTER_EMAIL, request.email),
     )
-    session.add(new_user)
-    session.commit()
-    session.refresh(new_user)
+
+    # Хешируем пароль и создаем пользователя; занятый email даёт 400
+    user_id = await create_user_with_referral(db=db, email=request.email, password=request.password)
 
     # Создаем JWT токен
-    token = create_jwt_token(new_user.id, new_user.email)
+    token = create_jwt_token(user_id, request.email)
 
     return {"access_token": token, "token_type": "bearer"}
 
 
 @app.post("/auth/login", response_model=Token, tags=["Authentication"], summary="Вход в систему")
+@query_budget(2)  # SELECT пользователя и UPDATE хеша, если изменилась стоимость bcrypt
 async def login(
         login_request: LoginRequest,
-        db: Session = Depends(get_db)
+        http_request: Request,
+        db: AsyncSession = Depends(get_db)
 ):
     """
     Авторизует пользователя и возвращает JWT токен.
@@ -77,23 +140,28 @@ async def login(
     - **email**: Электронная почта пользователя.
     - **password**: Пароль пользователя.
     """
-    user = get_user_by_email(db, login_request.email)
-    if not user:
-        raise HTTPException(status_code=400, detail="Неверный email или пароль")
+    # Перебор паролей ограничивается и по адресу, и по атакуемому email — до bcrypt и базы
+    await enforce_rate_limits(
+        (LOGIN_IP, client_ip(http_request)),
+        (LOGIN_EMAIL, login_request.email),
+    )
 
-    if not verify_password(login_request.password, user.password_hash):
+    # Неизвестный email и неверный пароль неотличимы ни по ответу, ни по времени
+    user = await authenticate_user(db, login_request.email, login_request.password)
+    if not user:
         raise HTTPException(status_code=400, detail="Неверный email или пароль")
 
-    token = create_jwt_token(user.id, user.email)
+    token = create_jwt_token(user.id, user.email, user.token_version)
 
     return {"access_token": token, "token_type": "bearer"}
 
 
 @app.post("/referral-code/create", tags=["Referrals"], summary="Создать реферальный код")
+@query_budget(4)  # пользователь, advisory-блокировка (PostgreSQL), INSERT и поиск причины отказа
 async def create_referral(
         referral_data: ReferralCodeCreate,
-        db: Session = Depends(get_db),
-        current_user: User = Depends(get_current_user)
+        db: AsyncSession = Depends(get_db),
+        current_user: CurrentUser = Depends(get_current_user)
 ):
     """
     Создает новый реферальный код для текущего пользователя.
@@ -101,56 +169,60 @@ async def create_referral(
     - **code**: Уникальный код.
     - **expiration_date**: Дата истечения срока действия кода.
     """
-    referral_code = create_referral_code(
+    referral_code = await create_referral_code(
         db,
         current_user.id,
         referral_data.code,
         referral_data.expiration_date
     )
+    # Обновляем записи в кешах, чтобы GET /referral-code/{email} и регистрация сразу видели новый код
+    await cache_referral_code(current_user.email, referral_code.code, referral_code.expiration_date)
+    await cache_valid_code(referral_code.code, current_user.id, referral_code.expiration_date)
     return {"message": "Реферальный код успешно создан", "code": referral_code.code,
             "expiration_date": referral_code.expiration_date}
 
 
 @app.delete("/referral-code/delete", tags=["Referrals"], summary="Удалить реферальный код")
+@query_budget(3)
 async def delete_referral(
-        db: Session = Depends(get_db),
-        current_user: User = Depends(get_current_user)
+        db: AsyncSession = Depends(get_db),
+        current_user: CurrentUser = Depends(get_current_user)
 ):
     """
     Удаляет реферальный код текущего пользователя.
     """
-    return delete_referral_code(db, current_user.id)
+    code = await delete_referral_code(db, current_user.id)
+    await invalidate_referral_codes([current_user.email])
+    await invalidate_valid_codes([code])
+    return {"message": "Реферальный код успешно удалён"}
 
 
 # Функция для получения реферального кода с кешированием в Redis
-@app.get("/referral-code/{email}", response_model=ReferralCode)
-async def get_referral_code_with_cache(email: str):
+@app.get("/referral-code/{email}", response_model=ReferralCode, tags=["Referrals"],
+         summary="Получить реферальный код по email")
+@query_budget(1)
+async def get_referral_code_with_cache(email: str, db: AsyncSession = Depends(get_db)):
     """
-      Получить реферальный код для указанного email. Сначала проверяется наличие реферального кода
-      в кеше Redis, если он найден — возвращается из кеша, если нет — генерируется новый код.
+      Получить активный реферальный код для указанного email. Сначала проверяется наличие кода
+      в кеше Redis, если он найден — возвращается из кеша, если нет — код загружается из базы
+      и кешируется до истечения его срока действия.
 
       - **email**: email пользователя, для которого требуется получить реферальный код.
     """
-
-    # Проверяем, есть ли уже реферальный код в кеше (Redis)
-    cached_referral_code = redis_client.get(f"referral_code:{email}")
-
-    if cached_referral_code:
-        # Если код найден в кеше, десериализуем его из JSON
-        return json.loads(cached_referral_code)
-
-    # Если кода нет в кеше, генерируем новый (для примера, просто код)
-    referral_code = ReferralCode(code="ABC123", email=email)
-
-    # Сохраняем код в Redis (срок хранения 3600 секунд, 1 час)
-    redis_client.setex(f"referral_code:{email}", 3600, referral_code.json())
-
-    # Возвращаем реферальный код
-    return referral_code
+    referral_code = await get_referral_code_cached(db, email)
+    if referral_code is None:
+        raise HTTPException(status_code=404, detail="Активный реферальный код не найден")
+    # Тело из кеша уже в формате ответа и отдаётся без разбора и повторной сериализации
+    return Response(content=referral_code, media_type="application/json")
 
 
 @app.post("/register-with-referral", tags=["Referrals"], summary="Регистрация с реферальным кодом")
-async def register_with_referral(request: RegisterWithReferralCodeRequest, db: Session = Depends(get_db)):
+@query_budget(7)
+async def register_with_referral(
+        request: RegisterWithReferralCodeRequest,
+        http_request: Request,
+        db: AsyncSession = Depends(get_db)
+):
     """
     Регистрирует пользователя по реферальному коду.
 
@@ -158,31 +230,170 @@ async def register_with_referral(request: RegisterWithReferralCodeRequest, db: S
     - **password**: Пароль пользователя.
     - **referral_code**: Код реферала (опционально).
     """
+    await enforce_rate_limits(
+        (REGISTER_IP, client_ip(http_request)),
+        (REGISTER_EMAIL, request.email),
+    )
+
     referrer_id = None
     if request.referral_code:
-        referral = get_valid_referral_code(db, request.referral_code)
-        if not referral:
+        # Код проверяется через кеш: при всплеске регистраций по одному коду база опрашивается один раз
+        referrer_id = await get_referrer_by_code_cached(db, request.referral_code)
+        if referrer_id is None:
             raise HTTPException(status_code=400, detail="Недействительный или истекший реферальный код")
-        referrer_id = referral.user_id
 
-    new_user = create_user_with_referral(
+    user_id = await create_user_with_referral(
         db=db,
         email=request.email,
         password=request.password,
-        referrer_id=referrer_id
+        referrer_id=referrer_id,
+        referral_code=request.referral_code
     )
 
-    return {"message": "Регистрация успешна", "user_id": new_user.id}
+    # Новый узел меняет сводки деревьев реферера и его предков
+    if referrer_id is not None:
+        await invalidate_referral_trees(await get_referrer_chain(db, referrer_id, REFERRAL_TREE_MAX_DEPTH))
+
+    return {"message": "Регистрация успешна", "user_id": user_id}
 
 
 @app.get("/referrals/{referrer_id}", response_model=List[UserBase], tags=["Referrals"], summary="Получить рефералов")
-async def get_referrals(referrer_id: int, db: Session = Depends(get_db)):
+@query_budget(2)
+async def get_referrals(
+        referrer_id: int,
+        limit: int = Query(REFERRALS_PAGE_SIZE, ge=1, le=REFERRALS_MAX_PAGE_SIZE),
+        cursor: Optional[int] = Query(None, description="id последнего реферала с предыдущей страницы"),
+        db: AsyncSession = Depends(get_db)
+):
+    """
+    Возвращает страницу пользователей, которые зарегистрировались по реферальному коду указанного пользователя.
+    Рефералы отсортированы по id; для следующей страницы передайте значение заголовка X-Next-Cursor в cursor.
+    Общее число рефералов возвращается в заголовке X-Total-Count на первой странице.
+
+    - **referrer_id**: ID реферера.
+    - **limit**: Размер страницы.
+    - **cursor**: Курсор следующей страницы.
+    """
+    referrals = await get_referrals_by_referrer_id(db, referrer_id, limit, after_id=cursor)
+    headers = {}
+    if cursor is None:
+        if not referrals:
+            raise HTTPException(status_code=404, detail="Рефералы не найдены")
+        total = len(referrals) if len(referrals) < limit else await count_referrals(db, referrer_id)
+        headers["X-Total-Count"] = str(total)
+    if len(referrals) == limit:
+        headers["X-Next-Cursor"] = str(referrals[-1].id)
+    # Строки уже содержат ровно поля UserBase, поэтому валидация response_model пропускается
+    return ORJSONResponse([referral._asdict() for referral in referrals], headers=headers)
+
+
+@app.get("/referrals/{referrer_id}/export", tags=["Referrals"], summary="Выгрузить всех рефералов (NDJSON)",
+         response_class=StreamingResponse)
+@query_budget(None)
+async def export_referrals(referrer_id: int):
     """
-    Возвращает список пользователей, которые зарегистрировались по реферальному коду указанного пользователя.
+    Потоково выгружает всех рефералов указанного пользователя в формате NDJSON (одна JSON-запись на строку).
+    Данные читаются пачками по id, поэтому расход памяти не зависит от числа рефералов.
 
     - **referrer_id**: ID реферера.
     """
-    referrals = get_referrals_by_referrer_id(db, referrer_id)
-    if not referrals:
+    async def generate():
+        # Сессия открывается внутри генератора: зависимость get_db закрывается до окончания стриминга
+        after_id = None
+        while True:
+            async with SessionLocal() as db:
+                batch = await get_referrals_by_referrer_id(db, referrer_id, REFERRALS_EXPORT_BATCH_SIZE, after_id)
+            if not batch:
+                break
+            yield b"".join(orjson.dumps(referral._asdict()) + b"\n" for referral in batch)
+            if len(batch) < REFERRALS_EXPORT_BATCH_SIZE:
+                break
+            after_id = batch[-1].id
+
+    return StreamingResponse(generate(), media_type="application/x-ndjson")
+
+
+@app.get("/referrals/{referrer_id}/tree", response_model=ReferralTreeSummary, tags=["Referrals"],
+         summary="Статистика дерева рефералов")
+@query_budget(1)
+async def get_referral_tree(
+        referrer_id: int,
+        max_depth: int = Query(REFERRAL_TREE_MAX_DEPTH, ge=1, le=REFERRAL_TREE_MAX_DEPTH),
+        db: AsyncSession = Depends(get_db)
+):
+    """
+    Возвращает сводку по всем уровням рефералов пользователя: количество на каждом уровне,
+    общий размер и глубину дерева. Сводка кешируется и сбрасывается при регистрации нового реферала.
+
+    - **referrer_id**: ID реферера.
+    - **max_depth**: Максимальная глубина обхода.
+    """
+    return Response(content=await get_referral_tree_cached(db, referrer_id, max_depth), media_type="application/json")
+
+
+@app.get("/referrals/{referrer_id}/stats", response_model=ReferralStats, tags=["Referrals"],
+         summary="Аналитика рефералов")
+@query_budget(3)
+async def get_referral_stats_endpoint(
+        referrer_id: int,
+        days: int = Query(30, ge=1, le=366, description="за сколько последних дней вернуть регистрации"),
+        db: AsyncSession = Depends(get_db)
+):
+    """
+    Возвращает число рефералов, регистрации по дням и число регистраций по каждому коду.
+    Значения читаются из счётчиков, которые обновляются при каждой регистрации.
+
+    - **referrer_id**: ID реферера.
+    - **days**: Глубина истории по дням.
+    """
+    stats = await get_referral_stats(db, referrer_id, days)
+    if stats is None:
         raise HTTPException(status_code=404, detail="Рефералы не найдены")
-    return referrals
+    return stats
+
+
+async def _read_bulk_rows(request: Request) -> list:
+    try:
+        return parse_rows(await request.body())
+    except ValueError as exc:
+        raise HTTPException(status_code=400, detail=f"Некорректное тело запроса: {exc}")
+
+
+@app.post("/bulk/users", response_model=BulkImportResult, tags=["Bulk"], summary="Массовая регистрация пользователей",
+          dependencies=[Depends(require_admin_token)])
+@query_budget(None)
+async def bulk_register_users(request: Request, db: AsyncSession = Depends(get_db)):
+    """
+    Регистрирует пользователей из JSON-массива или NDJSON (Content-Type: application/x-ndjson).
+    Требует заголовок X-Admin-Token. Возвращает результат по каждой строке.
+
+    Поля строки: **email**, **password** или готовый bcrypt **password_hash**, **referral_code** (опционально).
+    """
+    return await import_users(db, await _read_bulk_rows(request))
+
+
+@app.post("/bulk/referral-codes", response_model=BulkImportResult, tags=["Bulk"],
+          summary="Массовый импорт реферальных кодов", dependencies=[Depends(require_admin_token)])
+@query_budget(None)
+async def bulk_import_referral_codes(request: Request, db: AsyncSession = Depends(get_db)):
+    """
+    Импортирует реферальные коды из JSON-массива или NDJSON. Требует заголовок X-Admin-Token.
+
+    Поля строки: **code**, **expiration_date**, **user_id**.
+    """
+    return await import_referral_codes(db, await _read_bulk_rows(request))
+
+
+@app.post("/admin/users/{user_id}/revoke", tags=["Admin"], summary="Отозвать токены пользователя",
+          dependencies=[Depends(require_admin_token)])
+@query_budget(1)
+async def revoke_user_tokens(user_id: int, db: AsyncSession = Depends(get_db)):
+    """
+    Отзывает все выданные пользователю токены; новые токены выдаются при следующем входе.
+    Требует заголовок X-Admin-Token.
+
+    - **user_id**: ID пользователя.
+    """
+    if not await revoke_user(db, user_id):
+        raise HTTPException(status_code=404, detail="Пользователь не найден")
+    return {"message": "Токены пользователя отозваны"}
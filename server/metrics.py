@@ -0,0 +1,122 @@
+from prometheus_client import Counter, Gauge, Histogram
+
+# Метрики пула bcrypt
+HASH_QUEUE_DEPTH = Gauge(
+    "bcrypt_queue_depth",
+    "Количество операций bcrypt, ожидающих свободного воркера",
+    multiprocess_mode="livesum",
+)
+HASH_IN_FLIGHT = Gauge(
+    "bcrypt_in_flight",
+    "Количество операций bcrypt, принятых пулом (выполняются или ждут)",
+    multiprocess_mode="livesum",
+)
+HASH_LATENCY = Histogram(
+    "bcrypt_duration_seconds",
+    "Время операции bcrypt с учётом ожидания в очереди",
+    ["operation"],
+    buckets=(0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10),
+)
+HASH_COMPUTE = Histogram(
+    "bcrypt_compute_seconds",
+    "Время вычисления bcrypt в воркере без ожидания в очереди",
+    ["operation"],
+    buckets=(0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10),
+)
+HASH_REJECTED = Counter(
+    "bcrypt_rejected_total",
+    "Операции bcrypt, отклонённые из-за переполнения очереди",
+    ["operation"],
+)
+HASH_REHASHED = Counter(
+    "bcrypt_rehashed_total",
+    "Хеши паролей, пересчитанные при входе после смены стоимости bcrypt",
+)
+
+# HTTP
+HTTP_REQUEST_LATENCY = Histogram(
+    "http_request_duration_seconds",
+    "Время обработки HTTP-запроса",
+    ["method", "route", "status"],
+)
+HTTP_REQUEST_DB_QUERIES = Histogram(
+    "http_request_db_queries",
+    "Количество SQL-запросов на один HTTP-запрос",
+    ["route"],
+    buckets=(0, 1, 2, 3, 5, 10, 20, 50, 100),
+)
+HTTP_REQUEST_DB_TIME = Histogram(
+    "http_request_db_seconds",
+    "Суммарное время SQL-запросов в рамках одного HTTP-запроса",
+    ["route"],
+)
+QUERY_BUDGET_EXCEEDED = Counter(
+    "http_request_query_budget_exceeded_total",
+    "HTTP-запросы, превысившие бюджет SQL-запросов маршрута (QUERY_BUDGET_MODE)",
+    ["route"],
+)
+
+# База данных
+DB_QUERY_LATENCY = Histogram(
+    "db_query_duration_seconds",
+    "Время выполнения SQL-запроса",
+    buckets=(0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5),
+)
+DB_POOL_CHECKOUT_WAIT = Histogram(
+    "db_pool_checkout_wait_seconds",
+    "Время ожидания свободного соединения в пуле",
+    buckets=(0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5, 30),
+)
+
+# Redis и кеши
+CACHE_REQUESTS = Counter(
+    "cache_requests_total",
+    "Обращения к кешу",
+    ["cache", "result"],  # result: hit, miss, error
+)
+REDIS_ERRORS = Counter(
+    "redis_errors_total",
+    "Ошибки соединения с Redis",
+)
+
+# Очистка истёкших реферальных кодов
+SWEEPER_DELETED = Counter(
+    "referral_code_sweeper_deleted_total",
+    "Удалённые истёкшие реферальные коды",
+)
+SWEEPER_LAG = Gauge(
+    "referral_code_sweeper_lag_seconds",
+    "Возраст самого старого истёкшего кода, ожидающего удаления",
+    multiprocess_mode="livemax",
+)
+SWEEPER_LAST_RUN = Gauge(
+    "referral_code_sweeper_last_run_timestamp_seconds",
+    "Время завершения последнего прохода очистки",
+    multiprocess_mode="max",
+)
+
+# Ограничение частоты запросов
+RATE_LIMIT_DECISIONS = Counter(
+    "rate_limit_decisions_total",
+    "Решения ограничителя частоты запросов",
+    ["rule", "result"],  # result: allowed, rejected
+)
+RATE_LIMIT_LOCAL_FALLBACK = Counter(
+    "rate_limit_local_fallback_total",
+    "Проверки, выполненные локальными счётчиками из-за недоступности Redis",
+)
+
+# Outbox событий
+OUTBOX_PUBLISHED = Counter(
+    "outbox_published_total",
+    "События, доставленные из outbox в Redis Stream",
+)
+OUTBOX_FAILURES = Counter(
+    "outbox_publish_failures_total",
+    "Неудачные попытки доставки пачки событий (будут повторены)",
+)
+OUTBOX_LAG = Gauge(
+    "outbox_lag_seconds",
+    "Возраст самого старого недоставленного события",
+    multiprocess_mode="livemax",
+)
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, DateTime, ForeignKey
+from sqlalchemy import Column, Integer, String, DateTime, Date, ForeignKey, Index, JSON, func
 from sqlalchemy.orm import relationship
 from .database import Base
 from datetime import datetime
@@ -9,11 +9,23 @@ class User(Base):
     __tablename__ = "users"
 
     id = Column(Integer, primary_key=True, index=True)
-    email = Column(String, unique=True, index=True, nullable=False)
+    email = Column(String, nullable=False)  # уникальность и поиск — по индексу ix_users_email_lower
     password_hash = Column(String, nullable=False)
     referrer_id = Column(Integer, ForeignKey("users.id"), nullable=True)  # Внешний ключ
+    referral_code = Column(String, nullable=True)  # Код, по которому зарегистрирован пользователь
     created_at = Column(DateTime, default=datetime.utcnow)
-    referral_codes = relationship("ReferralCode", back_populates="user")
+    # Увеличивается при отзыве токенов; токены с другой версией (claim "ver") отклоняются
+    token_version = Column(Integer, nullable=False, default=0, server_default="0")
+    # Ленивая загрузка запрещена: в async-коде она всё равно невозможна, а в цикле даёт N+1.
+    # Связь загружается явно: options(selectinload(User.referral_codes))
+    referral_codes = relationship("ReferralCode", back_populates="user", lazy="raise")
+
+    __table_args__ = (
+        # Индекс для выборки рефералов с keyset-пагинацией по id
+        Index("ix_users_referrer_id_id", "referrer_id", "id"),
+        # Регистронезависимая уникальность и поиск по email одним обращением к индексу
+        Index("ix_users_email_lower", func.lower(email), unique=True),
+    )
 
 
 class ReferralCode(Base):
@@ -24,8 +36,62 @@ class ReferralCode(Base):
     expiration_date = Column(DateTime, nullable=False)
     user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
 
-    user = relationship("User", back_populates="referral_codes")
+    # Явно: options(joinedload(ReferralCode.user)) или options(selectinload(ReferralCode.user))
+    user = relationship("User", back_populates="referral_codes", lazy="raise")
+
+    # Индекс для поиска активного кода пользователя
+    __table_args__ = (
+        Index("ix_referral_codes_user_id_expiration_date", "user_id", "expiration_date"),
+    )
 
     # Метод для проверки, истек ли срок действия реферального кода
     def is_active(self):
         return self.expiration_date > datetime.utcnow()
+
+
+# Счётчики для аналитики рефералов: обновляются в транзакции регистрации,
+# поэтому дашборды читают готовые значения вместо COUNT(*) по users
+class ReferralStats(Base):
+    __tablename__ = "referral_stats"
+
+    referrer_id = Column(Integer, ForeignKey("users.id"), primary_key=True)
+    total = Column(Integer, nullable=False, default=0)
+    last_signup_at = Column(DateTime, nullable=True)
+
+
+class ReferralDailyStats(Base):
+    __tablename__ = "referral_daily_stats"
+
+    referrer_id = Column(Integer, ForeignKey("users.id"), primary_key=True)
+    day = Column(Date, primary_key=True)  # дата регистрации в UTC
+    signups = Column(Integer, nullable=False, default=0)
+
+
+class ReferralCodeStats(Base):
+    __tablename__ = "referral_code_stats"
+
+    # Без внешнего ключа на referral_codes: статистика переживает удаление истёкших кодов
+    referrer_id = Column(Integer, ForeignKey("users.id"), primary_key=True)
+    code = Column(String, primary_key=True)
+    signups = Column(Integer, nullable=False, default=0)
+
+
+# Transactional outbox: событие пишется в той же транзакции, что и изменение,
+# и удаляется после доставки в Redis Stream
+class OutboxEvent(Base):
+    __tablename__ = "outbox_events"
+
+    id = Column(Integer, primary_key=True)
+    # Ключ идемпотентности потребителей: id в SQLite переиспользуется после удаления доставленных событий
+    event_id = Column(String, nullable=False)
+    event_type = Column(String, nullable=False)
+    payload = Column(JSON, nullable=False)
+    created_at = Column(DateTime, nullable=False, default=datetime.utcnow)
+    attempts = Column(Integer, nullable=False, default=0)
+    next_attempt_at = Column(DateTime, nullable=False, default=datetime.utcnow)
+    last_error = Column(String, nullable=True)
+
+    # Диспетчер выбирает готовые к отправке события по порядку
+    __table_args__ = (
+        Index("ix_outbox_events_next_attempt_at_id", "next_attempt_at", "id"),
+    )
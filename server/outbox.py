@@ -0,0 +1,216 @@
+"""
+Доставка событий из таблицы outbox_events в Redis Stream.
+
+События пишутся в той же транзакции, что и изменения (регистрация
+пользователя), поэтому не теряются при сбое после commit. Диспетчер выбирает
+пачку событий (FOR UPDATE SKIP LOCKED — несколько диспетчеров не мешают друг
+другу), добавляет их в поток одним pipeline и удаляет из таблицы. Если Redis
+недоступен, пачка откладывается с экспоненциальной задержкой. Доставка
+«как минимум один раз»: событие может прийти повторно, поэтому потребители
+отмечают обработанные event_id (UUID, записанный вместе с событием) ключом
+идемпотентности (SET NX).
+
+    python -m server.outbox dispatch          # бесконечный цикл (при OUTBOX_MODE=off)
+    python -m server.outbox dispatch --once   # доставить всё накопленное и завершиться
+    python -m server.outbox consume --group audit   # потребитель, который пишет события в лог
+"""
+import argparse
+import asyncio
+import logging
+import time
+from datetime import datetime, timedelta
+from typing import Awaitable, Callable, Optional
+
+import orjson
+from redis.exceptions import ResponseError
+from sqlalchemy import select, delete, update, func
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from . import cache
+from .cache import redis_call, close_redis, UNAVAILABLE
+from .config import (OUTBOX_POLL_INTERVAL, OUTBOX_BATCH_SIZE, OUTBOX_MAX_BACKOFF, OUTBOX_STREAM,
+                     OUTBOX_STREAM_MAXLEN, OUTBOX_IDEMPOTENCY_TTL)
+from .database import SessionLocal, engine
+from .metrics import OUTBOX_PUBLISHED, OUTBOX_FAILURES, OUTBOX_LAG
+from .models import OutboxEvent
+
+logger = logging.getLogger(__name__)
+
+
+def _backoff(attempts: int) -> float:
+    return min(OUTBOX_MAX_BACKOFF, 2 ** attempts)
+
+
+async def dispatch_batch(db: AsyncSession, batch_size: int) -> int:
+    """
+    Доставляет не больше batch_size готовых событий. Возвращает число
+    доставленных; при ошибке Redis пачка откладывается и возвращается 0.
+    """
+    now = datetime.utcnow()
+    events = (await db.execute(
+        select(OutboxEvent.id, OutboxEvent.event_id, OutboxEvent.event_type, OutboxEvent.payload,
+               OutboxEvent.attempts)
+        .where(OutboxEvent.next_attempt_at <= now)
+        .order_by(OutboxEvent.id)
+        .limit(batch_size)
+        .with_for_update(skip_locked=True)
+    )).all()
+    if not events:
+        await db.commit()
+        return 0
+
+    async def publish(r):
+        async with r.pipeline(transaction=False) as pipe:
+            for _, event_id, event_type, payload, _ in events:
+                pipe.xadd(
+                    OUTBOX_STREAM,
+                    {"event_id": event_id, "type": event_type, "payload": orjson.dumps(payload)},
+                    maxlen=OUTBOX_STREAM_MAXLEN,
+                    approximate=True,
+                )
+            return await pipe.execute()
+
+    ids = [event.id for event in events]
+    if await redis_call(publish, default=UNAVAILABLE) is UNAVAILABLE:
+        OUTBOX_FAILURES.inc()
+        attempts = max(event.attempts for event in events) + 1
+        await db.execute(
+            update(OutboxEvent)
+            .where(OutboxEvent.id.in_(ids))
+            .values(
+                attempts=OutboxEvent.attempts + 1,
+                next_attempt_at=now + timedelta(seconds=_backoff(attempts)),
+                last_error="Redis недоступен",
+            )
+        )
+        await db.commit()
+        return 0
+
+    # Если commit не пройдёт, события будут отправлены повторно — потребители это учитывают
+    await db.execute(delete(OutboxEvent).where(OutboxEvent.id.in_(ids)))
+    await db.commit()
+    OUTBOX_PUBLISHED.inc(len(ids))
+    return len(ids)
+
+
+async def update_lag(db: AsyncSession) -> None:
+    oldest = (await db.execute(select(func.min(OutboxEvent.created_at)))).scalar_one_or_none()
+    OUTBOX_LAG.set((datetime.utcnow() - oldest).total_seconds() if oldest else 0)
+
+
+async def dispatch(batch_size: int = OUTBOX_BATCH_SIZE) -> int:
+    # Один проход: пачки отправляются, пока есть готовые события
+    total = 0
+    while True:
+        async with SessionLocal() as db:
+            published = await dispatch_batch(db, batch_size)
+        total += published
+        if published < batch_size:
+            break
+    async with SessionLocal() as db:
+        await update_lag(db)
+    return total
+
+
+async def run_dispatcher(interval: float = OUTBOX_POLL_INTERVAL) -> None:
+    while True:
+        try:
+            await dispatch()
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            logger.exception("Ошибка доставки событий outbox")
+        await asyncio.sleep(interval)
+
+
+def processed_event_key(group: str, event_id: str) -> str:
+    return f"outbox:processed:{group}:{event_id}"
+
+
+async def _ensure_group(redis_client, group: str) -> None:
+    try:
+        await redis_client.xgroup_create(OUTBOX_STREAM, group, id="0", mkstream=True)
+    except ResponseError as exc:
+        if "BUSYGROUP" not in str(exc):
+            raise
+
+
+async def consume_batch(group: str, consumer: str, handler: Callable[[str, dict], Awaitable[None]],
+                        processing_timeout: int = 60, block_ms: Optional[int] = 5000) -> int:
+    """
+    Один проход потребителя: вызывает handler(event_type, payload) для событий,
+    зависших у упавших потребителей (XAUTOCLAIM), и для новых событий группы.
+
+    Перед обработкой event_id занимается ключом SET NX: повторно доставленное
+    событие, которое уже обработано, только подтверждается. Ключ «processing»
+    живёт processing_timeout секунд — если потребитель упал, событие заберёт
+    другой. Ошибка обработчика снимает ключ, и событие повторяется позже.
+    """
+    redis_client = cache.redis_client
+    await _ensure_group(redis_client, group)
+
+    async def handle(message_id, fields) -> bool:
+        event_id = fields[b"event_id"].decode()
+        key = processed_event_key(group, event_id)
+        if not await redis_client.set(key, "processing", nx=True, ex=processing_timeout):
+            if await redis_client.get(key) == b"done":
+                await redis_client.xack(OUTBOX_STREAM, group, message_id)
+            return False
+        try:
+            await handler(fields[b"type"].decode(), orjson.loads(fields[b"payload"]))
+        except Exception:
+            await redis_client.delete(key)
+            logger.exception("Ошибка обработки события %s", event_id)
+            return False
+        await redis_client.set(key, "done", ex=OUTBOX_IDEMPOTENCY_TTL)
+        await redis_client.xack(OUTBOX_STREAM, group, message_id)
+        return True
+
+    _, claimed, *_ = await redis_client.xautoclaim(
+        OUTBOX_STREAM, group, consumer, min_idle_time=processing_timeout * 1000, count=100
+    )
+    messages = [(message_id, fields) for message_id, fields in claimed if fields]
+    for _, batch in await redis_client.xreadgroup(group, consumer, {OUTBOX_STREAM: ">"}, count=100, block=block_ms):
+        messages.extend(batch)
+
+    handled = 0
+    for message_id, fields in messages:
+        handled += await handle(message_id, fields)
+    return handled
+
+
+async def consume_events(group: str, consumer: str, handler: Callable[[str, dict], Awaitable[None]]) -> None:
+    while True:
+        await consume_batch(group, consumer, handler)
+
+
+async def _log_event(event_type: str, payload: dict) -> None:
+    logger.info("%s %s", event_type, payload)
+
+
+async def _run_cli(args) -> None:
+    try:
+        if args.command == "consume":
+            await consume_events(args.group, args.consumer, _log_event)
+        elif args.once:
+            print(await dispatch())
+        else:
+            await run_dispatcher()
+    finally:
+        await close_redis()
+        await engine.dispose()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("command", choices=["dispatch", "consume"])
+    parser.add_argument("--once", action="store_true", help="dispatch: один проход и завершиться")
+    parser.add_argument("--group", default="audit", help="consume: группа потребителей")
+    parser.add_argument("--consumer", default=f"consumer-{int(time.time())}", help="consume: имя потребителя")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(_run_cli(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,99 @@
+import math
+import time
+from dataclasses import dataclass
+from typing import Optional, Tuple
+
+from fastapi import HTTPException
+
+from .cache import redis_call, UNAVAILABLE
+from .config import RATE_LIMIT_LOGIN_IP, RATE_LIMIT_LOGIN_EMAIL, RATE_LIMIT_REGISTER_IP, RATE_LIMIT_REGISTER_EMAIL
+from .lru import TTLCache
+from .metrics import RATE_LIMIT_DECISIONS, RATE_LIMIT_LOCAL_FALLBACK
+
+
+@dataclass(frozen=True)
+class RateLimit:
+    name: str
+    limit: int
+    window: float  # секунды
+
+
+def parse_rate_limit(name: str, value: Optional[str]) -> Optional[RateLimit]:
+    # Формат "количество/секунды", например "10/60"
+    if not value:
+        return None
+    limit, window = value.split("/")
+    return RateLimit(name=name, limit=int(limit), window=float(window))
+
+
+LOGIN_IP = parse_rate_limit("login_ip", RATE_LIMIT_LOGIN_IP)
+LOGIN_EMAIL = parse_rate_limit("login_email", RATE_LIMIT_LOGIN_EMAIL)
+REGISTER_IP = parse_rate_limit("register_ip", RATE_LIMIT_REGISTER_IP)
+REGISTER_EMAIL = parse_rate_limit("register_email", RATE_LIMIT_REGISTER_EMAIL)
+
+# Локальные счётчики на случай недоступности Redis (действуют в пределах одного воркера)
+_local_counters = TTLCache(maxsize=100000, ttl=3600)
+
+
+def _window_keys(rule: RateLimit, identity: str, now: float) -> Tuple[str, str, float]:
+    window_index = int(now // rule.window)
+    base = f"ratelimit:{rule.name}:{identity}"
+    elapsed = now - window_index * rule.window
+    return f"{base}:{window_index}", f"{base}:{window_index - 1}", elapsed
+
+
+def _local_hit(current_key: str, previous_key: str, window: float) -> Tuple[int, int]:
+    current = _local_counters.get(current_key, 0) + 1
+    _local_counters.set(current_key, current, window * 2)
+    return current, _local_counters.get(previous_key, 0)
+
+
+async def enforce_rate_limits(*checks: Tuple[Optional[RateLimit], str]) -> None:
+    """
+    Скользящее окно на двух соседних счётчиках: оценка = текущее окно +
+    предыдущее окно, взвешенное по оставшейся доле. Все правила проверяются
+    одним pipeline в Redis; при его недоступности используются локальные счётчики.
+    Превышение любого правила даёт 429 с Retry-After.
+    """
+    checks = [(rule, identity) for rule, identity in checks if rule is not None]
+    if not checks:
+        return
+
+    now = time.time()
+    keys = [_window_keys(rule, identity, now) for rule, identity in checks]
+
+    async def hit(r):
+        async with r.pipeline(transaction=False) as pipe:
+            for (rule, _), (current_key, previous_key, _) in zip(checks, keys):
+                pipe.incr(current_key)
+                pipe.expire(current_key, int(rule.window * 2) + 1)
+                pipe.get(previous_key)
+            replies = await pipe.execute()
+        return [(int(replies[i]), int(replies[i + 2] or 0)) for i in range(0, len(replies), 3)]
+
+    counts = await redis_call(hit, default=UNAVAILABLE)
+    if counts is UNAVAILABLE:
+        RATE_LIMIT_LOCAL_FALLBACK.inc()
+        counts = [_local_hit(current_key, previous_key, rule.window)
+                  for (rule, _), (current_key, previous_key, _) in zip(checks, keys)]
+
+    retry_after = 0.0
+    for (rule, _), (_, _, elapsed), (current, previous) in zip(checks, keys, counts):
+        estimate = current + previous * (rule.window - elapsed) / rule.window
+        if estimate > rule.limit:
+            RATE_LIMIT_DECISIONS.labels(rule.name, "rejected").inc()
+            retry_after = max(retry_after, rule.window - elapsed)
+        else:
+            RATE_LIMIT_DECISIONS.labels(rule.name, "allowed").inc()
+
+    if retry_after:
+        raise HTTPException(
+            status_code=429,
+            detail="Слишком много попыток, повторите позже",
+            headers={"Retry-After": str(max(1, math.ceil(retry_after)))},
+        )
+
+
+def client_ip(request) -> str:
+    # За прокси адрес клиента подставляет uvicorn (--proxy-headers / --forwarded-allow-ips)
+    return request.client.host if request.client else "unknown"
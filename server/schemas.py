@@ -1,16 +1,34 @@
-from pydantic import BaseModel, EmailStr
-from datetime import datetime, date
-from typing import Optional
+from pydantic import AfterValidator, BaseModel, EmailStr
+from datetime import datetime, date, timezone
+from typing import Annotated, List, Optional
+
+
+def normalize_email(email: str) -> str:
+    # Email хранится и ищется в нижнем регистре: User@Mail.com и user@mail.com — один пользователь
+    return email.strip().lower()
+
+
+NormalizedEmail = Annotated[EmailStr, AfterValidator(normalize_email)]
+
+
+def to_naive_utc(value: datetime) -> datetime:
+    # Сроки хранятся в TIMESTAMP WITHOUT TIME ZONE в UTC; asyncpg не принимает в него datetime с часовым поясом
+    if value.tzinfo is None:
+        return value
+    return value.astimezone(timezone.utc).replace(tzinfo=None)
+
+
+NaiveUTCDatetime = Annotated[datetime, AfterValidator(to_naive_utc)]
 
 
 # Pydantic модель для запроса регистрации
 class RegisterRequest(BaseModel):
-    email: EmailStr
+    email: NormalizedEmail
     password: str
 
 
 class LoginRequest(BaseModel):
-    email: str
+    email: NormalizedEmail
     password: str
 
 
@@ -21,7 +39,7 @@ class Token(BaseModel):
 
 class ReferralCodeCreate(BaseModel):
     code: str  # сам реферальный код
-    expiration_date: datetime  # дата истечения срока действия кода
+    expiration_date: NaiveUTCDatetime  # дата истечения срока действия кода (UTC)
 
     class Config:
         from_attributes = True
@@ -36,11 +54,17 @@ class ReferralCodeResponse(BaseModel):
 
 
 class RegisterWithReferralCodeRequest(BaseModel):
-    email: EmailStr
+    email: NormalizedEmail
     password: str
     referral_code: Optional[str]  # Поле для ввода реферального кода
 
 
+# Пользователь, извлечённый из проверенного JWT токена
+class CurrentUser(BaseModel):
+    id: int
+    email: str
+
+
 class UserBase(BaseModel):
     id: int
     email: str
@@ -53,3 +77,62 @@ class UserBase(BaseModel):
 class ReferralCode(BaseModel):
     code: str
     email: str
+
+
+class ReferralTreeLevel(BaseModel):
+    depth: int  # уровень: 1 — прямые рефералы
+    count: int
+
+
+class ReferralTreeSummary(BaseModel):
+    referrer_id: int
+    total: int  # всего рефералов во всех уровнях
+    depth: int  # глубина самой длинной ветки
+    levels: List[ReferralTreeLevel]
+    truncated: bool  # обход остановлен по лимиту узлов
+
+
+class ReferralStatsDay(BaseModel):
+    day: date
+    signups: int
+
+
+class ReferralCodeStats(BaseModel):
+    code: str
+    signups: int  # регистраций по коду
+
+
+class ReferralStats(BaseModel):
+    referrer_id: int
+    total: int
+    last_signup_at: Optional[datetime]
+    daily: List[ReferralStatsDay]  # последние дни с регистрациями, по возрастанию даты
+    codes: List[ReferralCodeStats]
+
+
+# Строка массового импорта пользователей: пароль в открытом виде или готовый bcrypt-хеш
+class BulkUserRow(BaseModel):
+    email: NormalizedEmail
+    password: Optional[str] = None
+    password_hash: Optional[str] = None
+    referral_code: Optional[str] = None
+
+
+class BulkReferralCodeRow(BaseModel):
+    code: str
+    expiration_date: NaiveUTCDatetime
+    user_id: int
+
+
+class BulkRowResult(BaseModel):
+    index: int  # номер строки во входных данных
+    status: str  # created, duplicate или invalid
+    id: Optional[int] = None
+    error: Optional[str] = None
+
+
+class BulkImportResult(BaseModel):
+    created: int
+    duplicates: int
+    invalid: int
+    rows: List[BulkRowResult]
@@ -0,0 +1,117 @@
+"""
+Фоновая очистка истёкших реферальных кодов.
+
+Коды удаляются пачками (DELETE ... WHERE id IN (SELECT ... LIMIT n)), после чего
+из Redis удаляются соответствующие ключи кеша. Запускается как задача lifespan
+приложения (SWEEPER_MODE=lifespan) или отдельным воркером:
+
+    python -m server.sweeper          # бесконечный цикл
+    python -m server.sweeper --once   # один проход до полной очистки
+"""
+import argparse
+import asyncio
+import logging
+import time
+from datetime import datetime, timedelta
+
+from sqlalchemy import select, delete, func
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from .cache import invalidate_referral_codes, invalidate_valid_codes
+from .config import SWEEPER_INTERVAL, SWEEPER_BATCH_SIZE, SWEEPER_BATCH_PAUSE, SWEEPER_RETENTION_HOURS
+from .database import SessionLocal, engine
+from .metrics import SWEEPER_DELETED, SWEEPER_LAG, SWEEPER_LAST_RUN
+from .models import User, ReferralCode
+
+logger = logging.getLogger(__name__)
+
+
+def _cutoff() -> datetime:
+    return datetime.utcnow() - timedelta(hours=SWEEPER_RETENTION_HOURS)
+
+
+async def sweep_batch(db: AsyncSession, batch_size: int) -> int:
+    """
+    Удаляет не больше batch_size истёкших кодов одной транзакцией.
+    SKIP LOCKED позволяет нескольким воркерам чистить таблицу, не мешая друг другу.
+    """
+    expired_ids = (
+        select(ReferralCode.id)
+        .where(ReferralCode.expiration_date <= _cutoff())
+        .limit(batch_size)
+        .with_for_update(skip_locked=True)
+        .scalar_subquery()
+    )
+    result = await db.execute(
+        delete(ReferralCode).where(ReferralCode.id.in_(expired_ids)).returning(ReferralCode.code, ReferralCode.user_id)
+    )
+    deleted = result.all()
+    await db.commit()
+    if not deleted:
+        return 0
+
+    user_ids = {user_id for _, user_id in deleted}
+    emails = (await db.execute(select(User.email).where(User.id.in_(user_ids)))).scalars().all()
+    await invalidate_referral_codes(emails)
+    await invalidate_valid_codes(code for code, _ in deleted)
+    SWEEPER_DELETED.inc(len(deleted))
+    return len(deleted)
+
+
+async def update_lag(db: AsyncSession) -> None:
+    oldest = (await db.execute(
+        select(func.min(ReferralCode.expiration_date)).where(ReferralCode.expiration_date <= _cutoff())
+    )).scalar_one_or_none()
+    SWEEPER_LAG.set((_cutoff() - oldest).total_seconds() if oldest else 0)
+
+
+async def sweep(batch_size: int = SWEEPER_BATCH_SIZE, pause: float = SWEEPER_BATCH_PAUSE) -> int:
+    # Один проход: пачки удаляются, пока не останется истёкших кодов
+    total = 0
+    while True:
+        async with SessionLocal() as db:
+            deleted = await sweep_batch(db, batch_size)
+        total += deleted
+        if deleted < batch_size:
+            break
+        # Пауза между пачками, чтобы не вытеснять рабочую нагрузку
+        await asyncio.sleep(pause)
+    async with SessionLocal() as db:
+        await update_lag(db)
+    SWEEPER_LAST_RUN.set(time.time())
+    return total
+
+
+async def run_sweeper(interval: float = SWEEPER_INTERVAL) -> None:
+    while True:
+        try:
+            deleted = await sweep()
+            if deleted:
+                logger.info("Удалено истёкших реферальных кодов: %s", deleted)
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            logger.exception("Ошибка очистки истёкших реферальных кодов")
+        await asyncio.sleep(interval)
+
+
+async def _run_cli(once: bool) -> None:
+    try:
+        if once:
+            print(await sweep())
+        else:
+            await run_sweeper()
+    finally:
+        await engine.dispose()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--once", action="store_true", help="выполнить один проход и завершиться")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(_run_cli(args.once))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+"""
+Тесты поднимают приложение в процессе (ASGI без сети) против временной базы
+SQLite и fakeredis. Настройки читаются при импорте модулей приложения, поэтому
+окружение задаётся до импорта server.
+"""
+import os
+import tempfile
+
+os.environ.update({
+    "DATABASE_URL": f"sqlite:///{os.path.join(tempfile.mkdtemp(prefix='stakewolle-tests-'), 'test.db')}",
+    "SECRET_KEY": "test-secret-key",
+    "BCRYPT_ROUNDS": "4",
+    "ADMIN_TOKEN": "test-admin-token",
+    "SWEEPER_MODE": "off",
+    "OUTBOX_MODE": "off",
+    "RATE_LIMIT_LOGIN_IP": "",
+    "RATE_LIMIT_LOGIN_EMAIL": "",
+    "RATE_LIMIT_REGISTER_IP": "",
+    "RATE_LIMIT_REGISTER_EMAIL": "",
+    # Превышение бюджета SQL-запросов эндпоинта роняет тест
+    "QUERY_BUDGET_MODE": "raise",
+})
+
+import fakeredis  # noqa: E402
+import httpx  # noqa: E402
+import pytest  # noqa: E402
+
+from server import cache  # noqa: E402
+from server.database import Base, SessionLocal, engine  # noqa: E402
+from server.main import app  # noqa: E402
+
+PASSWORD = "test-password"
+
+
+@pytest.fixture
+def anyio_backend():
+    return "asyncio"
+
+
+@pytest.fixture
+async def redis(monkeypatch):
+    client = fakeredis.aioredis.FakeRedis()
+    monkeypatch.setattr(cache, "redis_client", client)
+    monkeypatch.setattr(cache, "_retry_at", 0.0)
+    cache.valid_code_cache.clear()
+    yield client
+    await client.aclose()
+
+
+@pytest.fixture
+async def database():
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.drop_all)
+        await conn.run_sync(Base.metadata.create_all)
+    yield engine
+    # Пул привязан к event loop теста
+    await engine.dispose()
+
+
+@pytest.fixture
+async def db(database):
+    async with SessionLocal() as session:
+        yield session
+
+
+@pytest.fixture
+async def client(database, redis):
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://test") as http_client:
+        yield http_client
+
+
+async def register(client: httpx.AsyncClient, email: str) -> str:
+    response = await client.post("/auth/register", json={"email": email, "password": PASSWORD})
+    assert response.status_code == 200, response.text
+    return response.json()["access_token"]
+
+
+def bearer(token: str) -> dict:
+    return {"Authorization": f"Bearer {token}"}
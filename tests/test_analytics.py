@@ -0,0 +1,75 @@
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy import select
+
+from server.analytics import rebuild_referral_stats
+from server.models import ReferralStats, ReferralDailyStats, ReferralCodeStats
+from .conftest import PASSWORD, register, bearer
+
+pytestmark = pytest.mark.anyio
+
+EXPIRATION = (datetime.utcnow() + timedelta(days=30)).isoformat()
+
+
+async def create_code(client, token: str, code: str) -> None:
+    response = await client.post("/referral-code/create", json={"code": code, "expiration_date": EXPIRATION},
+                                 headers=bearer(token))
+    assert response.status_code == 200, response.text
+
+
+async def register_with_referral(client, email: str, code: str) -> None:
+    response = await client.post("/register-with-referral",
+                                 json={"email": email, "password": PASSWORD, "referral_code": code})
+    assert response.status_code == 200, response.text
+
+
+async def counters(db) -> dict:
+    rows = {}
+    for model, columns in ((ReferralStats, (ReferralStats.referrer_id, ReferralStats.total,
+                                            ReferralStats.last_signup_at)),
+                           (ReferralDailyStats, (ReferralDailyStats.referrer_id, ReferralDailyStats.day,
+                                                 ReferralDailyStats.signups)),
+                           (ReferralCodeStats, (ReferralCodeStats.referrer_id, ReferralCodeStats.code,
+                                                ReferralCodeStats.signups))):
+        result = await db.execute(select(*columns))
+        rows[model.__tablename__] = sorted(tuple(row) for row in result.all())
+    return rows
+
+
+async def add_signups(client) -> None:
+    # Реферер 1 — два кода по очереди, реферер 2 — один; plain@example.com зарегистрирован без кода
+    first = await register(client, "first@example.com")
+    second = await register(client, "second@example.com")
+    await create_code(client, first, "FIRST-A")
+    await register_with_referral(client, "a1@example.com", "FIRST-A")
+    await register_with_referral(client, "a2@example.com", "FIRST-A")
+    assert (await client.delete("/referral-code/delete", headers=bearer(first))).status_code == 200
+    await create_code(client, first, "FIRST-B")
+    await register_with_referral(client, "b1@example.com", "FIRST-B")
+    await create_code(client, second, "SECOND")
+    await register_with_referral(client, "s1@example.com", "SECOND")
+    await register(client, "plain@example.com")
+
+
+async def test_registration_with_referral_updates_counters(client, db):
+    await add_signups(client)
+
+    stats = await counters(db)
+    today = datetime.utcnow().date()
+    assert [(referrer_id, total) for referrer_id, total, _ in stats["referral_stats"]] == [(1, 3), (2, 1)]
+    assert all(last_signup_at is not None for _, _, last_signup_at in stats["referral_stats"])
+    assert stats["referral_daily_stats"] == [(1, today, 3), (2, today, 1)]
+    assert stats["referral_code_stats"] == [(1, "FIRST-A", 2), (1, "FIRST-B", 1), (2, "SECOND", 1)]
+
+    response = await client.get("/referrals/1/stats")
+    assert response.status_code == 200
+    assert response.json()["total"] == 3
+
+
+async def test_rebuild_matches_incremental_counters(client, db):
+    await add_signups(client)
+    incremental = await counters(db)
+
+    await rebuild_referral_stats(db)
+    assert await counters(db) == incremental
@@ -0,0 +1,97 @@
+import pytest
+from passlib.context import CryptContext
+from sqlalchemy import select
+
+from server import auth, crud, hashing
+from server.models import User
+from .conftest import PASSWORD, register, bearer
+
+pytestmark = pytest.mark.anyio
+
+ADMIN = {"X-Admin-Token": "test-admin-token"}
+
+
+async def current_user_status(client, token: str) -> int:
+    # Любой эндпоинт с get_current_user; 404 — пользователь принят, но кода у него нет
+    return (await client.delete("/referral-code/delete", headers=bearer(token))).status_code
+
+
+async def login(client, email: str) -> str:
+    response = await client.post("/auth/login", json={"email": email, "password": PASSWORD})
+    assert response.status_code == 200
+    return response.json()["access_token"]
+
+
+@pytest.mark.parametrize("mode", ["strict", "stateless"])
+async def test_revoked_token_is_rejected(client, monkeypatch, mode):
+    monkeypatch.setattr(auth, "AUTH_MODE", mode)
+    token = await register(client, "user@example.com")
+    assert await current_user_status(client, token) == 404
+
+    assert (await client.post("/admin/users/1/revoke", headers=ADMIN)).status_code == 200
+    assert await current_user_status(client, token) == 401
+
+    # Новый вход выдаёт токен с актуальной версией
+    assert await current_user_status(client, await login(client, "user@example.com")) == 404
+
+
+async def test_revoked_token_is_rejected_in_stateless_mode_without_redis(client, monkeypatch):
+    monkeypatch.setattr(auth, "AUTH_MODE", "stateless")
+    token = await register(client, "user@example.com")
+    assert await current_user_status(client, token) == 404
+
+    async def down(operation, default=None, invalidation=False):
+        return default
+
+    monkeypatch.setattr(auth, "redis_call", down)
+    assert (await client.post("/admin/users/1/revoke", headers=ADMIN)).status_code == 200
+    assert await current_user_status(client, token) == 401
+
+
+async def test_revoke_requires_admin_token(client):
+    assert (await client.post("/admin/users/1/revoke")).status_code == 403
+
+
+async def test_revoke_unknown_user(client):
+    assert (await client.post("/admin/users/1/revoke", headers=ADMIN)).status_code == 404
+
+
+async def test_strict_mode_does_not_query_redis(client, monkeypatch):
+    token = await register(client, "user@example.com")
+
+    async def fail(operation, default=None, invalidation=False):
+        raise AssertionError("Redis не должен опрашиваться в режиме strict")
+
+    monkeypatch.setattr(auth, "redis_call", fail)
+    assert await current_user_status(client, token) == 404
+
+
+async def test_unknown_email_runs_dummy_verify(client, monkeypatch):
+    calls = []
+
+    def counting_dummy_verify():
+        calls.append(True)
+        return hashing.dummy_verify_sync()
+
+    monkeypatch.setattr(crud, "dummy_verify_sync", counting_dummy_verify)
+    response = await client.post("/auth/login", json={"email": "missing@example.com", "password": PASSWORD})
+    assert response.status_code == 400
+    assert calls == [True]
+
+
+async def test_outdated_hash_is_rewritten_once_after_login(client, db, monkeypatch):
+    await register(client, "user@example.com")
+    old_hash = (await db.execute(select(User.password_hash))).scalar_one()
+
+    # Стоимость выросла: хеш, созданный при регистрации, теперь устаревший
+    monkeypatch.setattr(hashing, "pwd_context", CryptContext(
+        schemes=["bcrypt"], deprecated="auto", bcrypt__rounds=5, bcrypt__min_rounds=5, bcrypt__max_rounds=5,
+    ))
+    await login(client, "user@example.com")
+    new_hash = (await db.execute(select(User.password_hash))).scalar_one()
+    assert new_hash != old_hash
+    assert new_hash.startswith("$2b$05$")
+
+    # Новый хеш соответствует стоимости: повторный вход его не пересчитывает (у пересчёта была бы новая соль)
+    await login(client, "user@example.com")
+    assert (await db.execute(select(User.password_hash))).scalar_one() == new_hash
@@ -0,0 +1,61 @@
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy import func, select
+
+from server import bulk
+from server.crud import create_referral_code
+from server.database import SessionLocal
+from server.models import User, ReferralCode
+
+pytestmark = pytest.mark.anyio
+
+ADMIN = {"X-Admin-Token": "test-admin-token"}
+ACTIVE = (datetime.utcnow() + timedelta(days=30)).isoformat()
+EXPIRED = (datetime.utcnow() - timedelta(days=1)).isoformat()
+
+
+async def add_users(db, count: int) -> None:
+    db.add_all(User(id=i, email=f"user{i}@example.com", password_hash="-") for i in range(1, count + 1))
+    await db.commit()
+
+
+async def import_codes(client, rows):
+    response = await client.post("/bulk/referral-codes", json=rows, headers=ADMIN)
+    assert response.status_code == 200, response.text
+    return response.json()
+
+
+async def test_import_referral_codes(client, db):
+    await add_users(db, 2)
+    result = await import_codes(client, [
+        {"code": "A", "expiration_date": ACTIVE, "user_id": 1},
+        {"code": "OLD", "expiration_date": EXPIRED, "user_id": 1},
+        {"code": "B", "expiration_date": ACTIVE, "user_id": 1},
+        {"code": "C", "expiration_date": ACTIVE, "user_id": 3},
+    ])
+    assert [row["status"] for row in result["rows"]] == ["created", "created", "invalid", "invalid"]
+
+    # Повторный импорт уже загруженного кода
+    result = await import_codes(client, [{"code": "OLD", "expiration_date": EXPIRED, "user_id": 1}])
+    assert result["duplicates"] == 1
+
+
+async def test_import_does_not_race_with_create(client, db, monkeypatch):
+    await add_users(db, 1)
+    lock = bulk.lock_referral_code_users
+
+    async def create_meanwhile(session, user_ids):
+        # Код создаётся через /referral-code/create после предварительной проверки импорта
+        async with SessionLocal() as other:
+            await create_referral_code(other, 1, "CREATED", datetime.utcnow() + timedelta(days=1))
+        await lock(session, user_ids)
+
+    monkeypatch.setattr(bulk, "lock_referral_code_users", create_meanwhile)
+    result = await import_codes(client, [{"code": "IMPORTED", "expiration_date": ACTIVE, "user_id": 1}])
+
+    assert result["rows"][0]["status"] == "invalid"
+    active = select(func.count()).select_from(ReferralCode).where(
+        ReferralCode.user_id == 1, ReferralCode.expiration_date > datetime.utcnow()
+    )
+    assert (await db.execute(active)).scalar_one() == 1
@@ -0,0 +1,160 @@
+from datetime import datetime, timedelta
+
+import pytest
+from redis import asyncio as aioredis
+from redis.exceptions import ConnectionError as RedisConnectionError
+
+from server import cache
+from server.models import User, ReferralCode
+from .conftest import register, bearer
+
+pytestmark = pytest.mark.anyio
+
+EXPIRATION = (datetime.utcnow() + timedelta(days=30)).isoformat()
+
+
+async def add_user_with_code(db, email: str, code=None) -> int:
+    user = User(email=email, password_hash="-")
+    db.add(user)
+    await db.flush()
+    if code:
+        db.add(ReferralCode(code=code, expiration_date=datetime.utcnow() + timedelta(days=1), user_id=user.id))
+    await db.commit()
+    return user.id
+
+
+async def test_read_through_miss_then_hit(db, redis):
+    await add_user_with_code(db, "owner@example.com", "CODE1")
+
+    assert await cache.get_referral_code_cached(db, "owner@example.com") == b'{"code":"CODE1","email":"owner@example.com"}'
+    assert 0 < await redis.ttl(cache.referral_code_key("owner@example.com")) <= cache.REFERRAL_CODE_CACHE_TTL
+
+    # Второе чтение обслуживается из Redis: изменение в базе мимо API не видно
+    await db.execute(ReferralCode.__table__.delete())
+    await db.commit()
+    assert await cache.get_referral_code_cached(db, "OWNER@example.com") == b'{"code":"CODE1","email":"owner@example.com"}'
+
+
+async def test_missing_code_is_cached_briefly(db, redis):
+    user_id = await add_user_with_code(db, "owner@example.com")
+
+    assert await cache.get_referral_code_cached(db, "owner@example.com") is None
+    key = cache.referral_code_key("owner@example.com")
+    assert await redis.get(key) == cache.NEGATIVE_MARKER
+    assert await redis.ttl(key) <= cache.REFERRAL_CODE_NEGATIVE_TTL
+
+    db.add(ReferralCode(code="LATE", expiration_date=datetime.utcnow() + timedelta(days=1), user_id=user_id))
+    await db.commit()
+    assert await cache.get_referral_code_cached(db, "owner@example.com") is None
+
+
+async def test_create_and_delete_invalidate_cache(client):
+    token = await register(client, "owner@example.com")
+    assert (await client.get("/referral-code/owner@example.com")).status_code == 404
+
+    response = await client.post("/referral-code/create", json={"code": "CODE1", "expiration_date": EXPIRATION},
+                                 headers=bearer(token))
+    assert response.status_code == 200, response.text
+    response = await client.get("/referral-code/owner@example.com")
+    assert response.status_code == 200
+    assert response.json() == {"code": "CODE1", "email": "owner@example.com"}
+
+    assert (await client.delete("/referral-code/delete", headers=bearer(token))).status_code == 200
+    assert (await client.get("/referral-code/owner@example.com")).status_code == 404
+    response = await client.post("/register-with-referral",
+                                 json={"email": "late@example.com", "password": "x", "referral_code": "CODE1"})
+    assert response.status_code == 400
+
+
+async def test_invalidation_is_pipelined(redis, monkeypatch):
+    emails = ["a@example.com", "b@example.com", "c@example.com"]
+    for email in emails:
+        await redis.set(cache.referral_code_key(email), b"cached")
+
+    round_trips = []
+    execute_command = redis.execute_command
+
+    async def counting_execute_command(*args, **kwargs):
+        round_trips.append(args[0])
+        return await execute_command(*args, **kwargs)
+
+    monkeypatch.setattr(redis, "execute_command", counting_execute_command)
+    await cache.invalidate_referral_codes(emails)
+
+    # Команды pipeline не проходят через execute_command клиента
+    assert round_trips == []
+    for email in emails:
+        assert await redis.get(cache.referral_code_key(email)) == cache.INVALIDATED_MARKER
+
+
+async def test_stale_fill_does_not_override_invalidation(db, redis, monkeypatch):
+    await add_user_with_code(db, "owner@example.com", "CODE1")
+    read = cache.get_referral_code_by_email
+
+    async def read_then_delete(session, email):
+        # Код удаляется и кеш сбрасывается между чтением из базы и записью в кеш
+        row = await read(session, email)
+        await cache.invalidate_referral_codes([email])
+        return row
+
+    monkeypatch.setattr(cache, "get_referral_code_by_email", read_then_delete)
+    assert await cache.get_referral_code_cached(db, "owner@example.com") is not None
+    assert await redis.get(cache.referral_code_key("owner@example.com")) == cache.INVALIDATED_MARKER
+
+
+async def test_stale_valid_code_fill_is_not_cached(db, redis, monkeypatch):
+    await add_user_with_code(db, "owner@example.com", "CODE1")
+    read = cache.get_valid_referral_code
+
+    async def read_then_delete(session, code):
+        row = await read(session, code)
+        await cache.invalidate_valid_codes([code])
+        return row
+
+    monkeypatch.setattr(cache, "get_valid_referral_code", read_then_delete)
+    assert await cache.get_referrer_by_code_cached(db, "CODE1") is not None
+    assert await redis.get(cache.valid_code_key("CODE1")) == cache.INVALIDATED_MARKER
+    assert cache.valid_code_cache.get("CODE1", cache.UNAVAILABLE) is cache.UNAVAILABLE
+
+
+async def test_falls_back_to_database_when_redis_is_down(db, monkeypatch):
+    await add_user_with_code(db, "owner@example.com", "CODE1")
+    unreachable = aioredis.Redis(host="127.0.0.1", port=1, socket_connect_timeout=0.1, socket_timeout=0.1)
+    monkeypatch.setattr(cache, "redis_client", unreachable)
+    monkeypatch.setattr(cache, "_retry_at", 0.0)
+
+    assert await cache.redis_call(lambda r: r.get("key"), default="fallback") == "fallback"
+    assert cache._retry_at > 0
+
+    # Пока не истёк REDIS_RETRY_INTERVAL, Redis не опрашивается
+    async def fail(r):
+        raise AssertionError("Redis не должен вызываться")
+
+    assert await cache.redis_call(fail, default="skipped") == "skipped"
+    assert await cache.get_referral_code_cached(db, "owner@example.com") == b'{"code":"CODE1","email":"owner@example.com"}'
+    assert await cache.get_referrer_by_code_cached(db, "CODE1") is not None
+    await unreachable.aclose()
+
+
+async def test_invalidation_is_sent_during_backoff(redis, monkeypatch):
+    key = cache.referral_code_key("owner@example.com")
+    await redis.set(key, b"cached")
+    # Недавняя ошибка Redis: обычные операции пропускаются, а сброс — нет
+    monkeypatch.setattr(cache, "_retry_at", float("inf"))
+
+    assert await cache.redis_call(lambda r: r.get(key), default="skipped") == "skipped"
+    await cache.invalidate_referral_codes(["owner@example.com"])
+    assert await redis.get(key) == cache.INVALIDATED_MARKER
+
+
+async def test_invalidation_is_retried(redis):
+    calls = []
+
+    async def flaky(r):
+        calls.append(1)
+        if len(calls) == 1:
+            raise RedisConnectionError("connection reset")
+        return "ok"
+
+    assert await cache.redis_call(flaky, invalidation=True) == "ok"
+    assert len(calls) == 2
@@ -0,0 +1,38 @@
+import pytest
+from sqlalchemy import select, text
+
+from server import emails
+from server.models import User
+
+pytestmark = pytest.mark.anyio
+
+
+async def seed(db, addresses) -> None:
+    # Состояние до миграции ix_users_email_lower: email в разном регистре
+    await db.execute(text("DROP INDEX ix_users_email_lower"))
+    db.add_all(User(email=email, password_hash="-") for email in addresses)
+    await db.commit()
+
+
+async def stored_emails(db) -> list:
+    return (await db.execute(select(User.email).order_by(User.id))).scalars().all()
+
+
+async def test_backfill_normalizes_emails_in_batches(db, redis):
+    await seed(db, ["Alice@Example.com", "bob@example.com", "CAROL@EXAMPLE.COM", "dave@example.com", "Eve@example.com"])
+
+    assert await emails.find_duplicates(db) == []
+    assert await emails.backfill(batch_size=2) == 3
+    assert await stored_emails(db) == [
+        "alice@example.com", "bob@example.com", "carol@example.com", "dave@example.com", "eve@example.com"
+    ]
+
+
+async def test_backfill_refuses_case_insensitive_duplicates(db, redis):
+    await seed(db, ["Alice@Example.com", "alice@example.com", "Bob@example.com"])
+
+    assert await emails.find_duplicates(db) == ["alice@example.com"]
+    with pytest.raises(emails.DuplicateEmailsError) as error:
+        await emails.backfill(batch_size=100)
+    assert error.value.emails == ["alice@example.com"]
+    assert await stored_emails(db) == ["Alice@Example.com", "alice@example.com", "Bob@example.com"]
@@ -0,0 +1,71 @@
+import asyncio
+import threading
+
+import pytest
+from fastapi import HTTPException
+
+from server import bulk, crud
+from server.hashing import HashingPool, hashing_pool
+from .conftest import PASSWORD, register
+
+pytestmark = pytest.mark.anyio
+
+ADMIN = {"X-Admin-Token": "test-admin-token"}
+
+
+async def test_full_pool_rejects_new_operations():
+    pool = HashingPool("thread", workers=1, queue_size=1)
+    release = threading.Event()
+    try:
+        # Один вызов выполняется, второй ждёт в очереди — пул заполнен
+        blocked = [asyncio.create_task(pool.run("hash", release.wait)) for _ in range(2)]
+        await asyncio.sleep(0.05)
+        with pytest.raises(HTTPException) as rejected:
+            await pool.run("hash", lambda: None)
+        assert rejected.value.status_code == 503
+        assert rejected.value.headers == {"Retry-After": "1"}
+    finally:
+        release.set()
+        await asyncio.gather(*blocked)
+        pool.shutdown()
+    assert pool.pending == 0
+
+
+async def test_overloaded_pool_returns_503(client, monkeypatch):
+    monkeypatch.setattr(hashing_pool, "pending", hashing_pool.limit)
+    response = await client.post("/auth/register", json={"email": "user@example.com", "password": PASSWORD})
+    assert response.status_code == 503
+    assert response.headers["Retry-After"] == "1"
+
+
+async def test_login_completes_while_bulk_hash_is_running(client, monkeypatch):
+    # Очереди нет: если импорт займёт все воркеры, вход получит 503
+    pool = HashingPool("thread", workers=2, queue_size=0)
+    monkeypatch.setattr(crud, "hashing_pool", pool)
+    monkeypatch.setattr(bulk, "hashing_pool", pool)
+    monkeypatch.setattr(bulk, "BULK_HASH_WORKERS", 1)
+    monkeypatch.setattr(bulk, "BULK_HASH_CHUNK_SIZE", 1)
+    await register(client, "user@example.com")
+
+    release = threading.Event()
+
+    def blocked_hash(passwords):
+        release.wait()
+        return [crud.hash_password_sync(password) for password in passwords]
+
+    monkeypatch.setattr(bulk, "hash_passwords_sync", blocked_hash)
+    rows = [{"email": f"bulk{i}@example.com", "password": PASSWORD} for i in range(4)]
+    importing = asyncio.create_task(client.post("/bulk/users", json=rows, headers=ADMIN))
+    try:
+        await asyncio.sleep(0.05)
+        assert pool.pending == 1
+
+        response = await asyncio.wait_for(
+            client.post("/auth/login", json={"email": "user@example.com", "password": PASSWORD}), timeout=5)
+        assert response.status_code == 200
+        assert not importing.done()
+    finally:
+        release.set()
+        imported = await importing
+        pool.shutdown()
+    assert [row["status"] for row in imported.json()["rows"]] == ["created"] * 4
@@ -0,0 +1,29 @@
+import os
+import subprocess
+import sys
+
+# Отдельный процесс: адрес базы читается при импорте приложения
+SCRIPT = """
+import asyncio
+import fakeredis
+import httpx
+from server import cache
+from server.main import app
+
+async def main():
+    cache.redis_client = fakeredis.aioredis.FakeRedis()
+    async with app.router.lifespan_context(app):
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            response = await client.post("/auth/register", json={"email": "user@example.com", "password": "x"})
+            print(response.status_code)
+
+asyncio.run(main())
+"""
+
+
+def test_memory_database_gets_schema_on_startup():
+    env = {**os.environ, "DATABASE_URL": "sqlite:///:memory:"}
+    result = subprocess.run([sys.executable, "-c", SCRIPT], env=env, capture_output=True, text=True, timeout=60,
+                            cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    assert result.stdout.strip() == "200", result.stderr
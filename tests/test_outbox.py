@@ -0,0 +1,38 @@
+import pytest
+from sqlalchemy import select
+
+from server import outbox
+from server.models import OutboxEvent
+from .conftest import register
+
+pytestmark = pytest.mark.anyio
+
+
+async def deliver(handled: list) -> int:
+    async def handler(event_type, payload):
+        handled.append((event_type, payload["email"]))
+
+    await outbox.dispatch()
+    return await outbox.consume_batch("test", "consumer", handler, block_ms=None)
+
+
+async def test_registration_event_is_delivered_once(client, redis):
+    await register(client, "first@example.com")
+    handled = []
+    assert await deliver(handled) == 1
+    # Повторная доставка того же сообщения только подтверждается
+    assert await deliver(handled) == 0
+    assert handled == [("user.registered", "first@example.com")]
+
+
+async def test_events_after_drained_outbox_are_not_skipped(client, db, redis):
+    handled = []
+    await register(client, "first@example.com")
+    await deliver(handled)
+
+    # В SQLite id опустевшей таблицы начинается заново, поэтому ключом идемпотентности служит event_id
+    await register(client, "second@example.com")
+    ids = (await db.execute(select(OutboxEvent.id))).scalars().all()
+    assert ids == [1]
+    assert await deliver(handled) == 1
+    assert handled == [("user.registered", "first@example.com"), ("user.registered", "second@example.com")]
@@ -0,0 +1,61 @@
+"""
+Эндпоинты вызываются по самому дорогому пути при QUERY_BUDGET_MODE=raise
+(задан в conftest): лишний SQL-запрос или N+1 роняет тест.
+"""
+from datetime import datetime, timedelta
+
+import pytest
+from passlib.context import CryptContext
+from sqlalchemy import select
+
+from server import main
+from server.instrumentation import QueryBudgetExceeded
+from server.models import User
+from .conftest import PASSWORD, register, bearer
+
+pytestmark = pytest.mark.anyio
+
+EXPIRATION = (datetime.utcnow() + timedelta(days=30)).isoformat()
+
+
+async def test_login_with_rehash(client, db):
+    # Хеш с другой стоимостью пересчитывается при входе: SELECT + UPDATE
+    db.add(User(email="old@example.com", password_hash=CryptContext(schemes=["bcrypt"], bcrypt__rounds=5).hash(PASSWORD)))
+    await db.commit()
+
+    response = await client.post("/auth/login", json={"email": "old@example.com", "password": PASSWORD})
+    assert response.status_code == 200
+    password_hash = (await db.execute(select(User.password_hash))).scalar_one()
+    assert password_hash.startswith("$2b$04$")
+
+
+async def test_referral_code_lifecycle(client):
+    token = await register(client, "owner@example.com")
+    other = await register(client, "other@example.com")
+    code = {"code": "CODE1", "expiration_date": EXPIRATION}
+
+    assert (await client.post("/referral-code/create", json=code, headers=bearer(token))).status_code == 200
+    # Оба отказа выясняют причину дополнительным запросом
+    assert (await client.post("/referral-code/create", json={**code, "code": "CODE2"},
+                              headers=bearer(token))).status_code == 400
+    assert (await client.post("/referral-code/create", json=code, headers=bearer(other))).status_code == 400
+
+    assert (await client.get("/referral-code/owner@example.com")).status_code == 200
+    for i in range(3):
+        response = await client.post("/register-with-referral", json={
+            "email": f"referral{i}@example.com", "password": PASSWORD, "referral_code": "CODE1"
+        })
+        assert response.status_code == 200
+
+    response = await client.get("/referrals/1", params={"limit": 2})
+    assert response.headers["X-Total-Count"] == "3"
+    assert (await client.get("/referrals/1/tree")).status_code == 200
+    assert (await client.get("/referrals/1/stats")).status_code == 200
+    assert (await client.delete("/referral-code/delete", headers=bearer(token))).status_code == 200
+    assert (await client.get("/health/ready")).status_code == 200
+
+
+async def test_exceeded_budget_raises(client, monkeypatch):
+    monkeypatch.setattr(main.register_user, "query_budget", 1)
+    with pytest.raises(QueryBudgetExceeded, match="/auth/register: 2 SQL-запросов при бюджете 1"):
+        await client.post("/auth/register", json={"email": "user@example.com", "password": PASSWORD})
@@ -0,0 +1,22 @@
+import pytest
+
+from server import main
+from server.ratelimit import parse_rate_limit
+from .conftest import PASSWORD
+
+pytestmark = pytest.mark.anyio
+
+
+async def test_registration_is_limited_per_email(client, monkeypatch):
+    monkeypatch.setattr(main, "REGISTER_EMAIL", parse_rate_limit("register_email", "2/60"))
+
+    statuses = [
+        (await client.post("/auth/register", json={"email": email, "password": PASSWORD})).status_code
+        for email in ["target@example.com", "Target@example.com", "TARGET@example.com", "other@example.com"]
+    ]
+    assert statuses == [200, 400, 429, 200]
+
+    response = await client.post("/register-with-referral",
+                                 json={"email": "target@example.com", "password": PASSWORD, "referral_code": None})
+    assert response.status_code == 429
+    assert int(response.headers["Retry-After"]) >= 1
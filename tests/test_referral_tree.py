@@ -0,0 +1,32 @@
+import orjson
+import pytest
+
+from server import cache
+from server.models import User
+
+pytestmark = pytest.mark.anyio
+
+
+async def add_chain(db, length: int) -> None:
+    # Пользователь 1 — корень, каждый следующий приглашён предыдущим
+    for i in range(1, length + 1):
+        db.add(User(id=i, email=f"user{i}@example.com", password_hash="-", referrer_id=i - 1 if i > 1 else None))
+        await db.flush()
+    await db.commit()
+
+
+async def test_tree_summary(db, redis):
+    await add_chain(db, 4)
+    summary = orjson.loads(await cache.get_referral_tree_cached(db, 1, 10))
+    assert summary == {"referrer_id": 1, "total": 3, "depth": 3, "truncated": False,
+                       "levels": [{"depth": 1, "count": 1}, {"depth": 2, "count": 1}, {"depth": 3, "count": 1}]}
+
+
+async def test_truncated_tree_levels_add_up_to_total(db, redis, monkeypatch):
+    await add_chain(db, 6)
+    monkeypatch.setattr(cache, "REFERRAL_TREE_MAX_NODES", 3)
+    summary = orjson.loads(await cache.get_referral_tree_cached(db, 1, 10))
+    assert summary["truncated"] is True
+    assert summary["total"] == 3
+    assert sum(level["count"] for level in summary["levels"]) == 3
+    assert summary["depth"] == summary["levels"][-1]["depth"]
@@ -0,0 +1,64 @@
+from datetime import datetime
+
+import orjson
+import pytest
+
+from server import main
+from server.models import User
+
+pytestmark = pytest.mark.anyio
+
+REFERRALS = 25
+
+
+async def add_referrals(db, count: int) -> None:
+    # У всех рефералов одинаковый created_at: порядок страниц не должен от него зависеть
+    created_at = datetime(2026, 1, 1)
+    db.add(User(id=1, email="referrer@example.com", password_hash="-", created_at=created_at))
+    db.add(User(id=2, email="other@example.com", password_hash="-", created_at=created_at))
+    await db.flush()
+    for i in range(count):
+        # Чередуем реферера, чтобы в выборку не попадали чужие рефералы
+        db.add(User(email=f"referral{i}@example.com", password_hash="-", referrer_id=1, created_at=created_at))
+        db.add(User(email=f"foreign{i}@example.com", password_hash="-", referrer_id=2, created_at=created_at))
+    await db.commit()
+
+
+async def test_pages_cover_all_referrals_without_duplicates(client, db):
+    await add_referrals(db, REFERRALS)
+
+    seen, cursor, pages = [], None, 0
+    while True:
+        params = {"limit": 7} if cursor is None else {"limit": 7, "cursor": cursor}
+        response = await client.get("/referrals/1", params=params)
+        assert response.status_code == 200
+        if cursor is None:
+            assert response.headers["X-Total-Count"] == str(REFERRALS)
+        seen.extend(referral["email"] for referral in response.json())
+        pages += 1
+        cursor = response.headers.get("X-Next-Cursor")
+        if cursor is None:
+            break
+
+    assert pages == 4
+    assert len(seen) == len(set(seen))
+    assert set(seen) == {f"referral{i}@example.com" for i in range(REFERRALS)}
+
+
+async def test_invalid_cursor_is_rejected(client, db):
+    await add_referrals(db, 3)
+    response = await client.get("/referrals/1", params={"cursor": "not-a-cursor"})
+    assert response.status_code == 422
+
+
+async def test_export_contains_every_referral_once(client, db, monkeypatch):
+    monkeypatch.setattr(main, "REFERRALS_EXPORT_BATCH_SIZE", 4)
+    await add_referrals(db, REFERRALS)
+
+    response = await client.get("/referrals/1/export")
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "application/x-ndjson"
+    lines = response.content.splitlines()
+    assert len(lines) == REFERRALS
+    emails = [orjson.loads(line)["email"] for line in lines]
+    assert set(emails) == {f"referral{i}@example.com" for i in range(REFERRALS)}
@@ -0,0 +1,37 @@
+import asyncio
+from collections import Counter
+
+import pytest
+from sqlalchemy import func, select
+
+from server.models import User
+from .conftest import PASSWORD
+
+pytestmark = pytest.mark.anyio
+
+CONCURRENCY = 20
+
+
+async def register_concurrently(client, emails):
+    responses = await asyncio.gather(*(
+        client.post("/auth/register", json={"email": email, "password": PASSWORD}) for email in emails
+    ))
+    return Counter(response.status_code for response in responses)
+
+
+async def users_count(db) -> int:
+    return (await db.execute(select(func.count()).select_from(User))).scalar_one()
+
+
+async def test_concurrent_registrations_with_one_email(client, db):
+    statuses = await register_concurrently(client, ["same@example.com"] * CONCURRENCY)
+    assert statuses == {200: 1, 400: CONCURRENCY - 1}
+    assert await users_count(db) == 1
+
+
+async def test_concurrent_registrations_with_differently_cased_email(client, db):
+    variants = ["same@example.com", "Same@Example.com", "SAME@EXAMPLE.COM", " sAmE@example.com"]
+    emails = [variants[i % len(variants)] for i in range(CONCURRENCY)]
+    statuses = await register_concurrently(client, emails)
+    assert statuses == {200: 1, 400: CONCURRENCY - 1}
+    assert (await db.execute(select(User.email))).scalars().all() == ["same@example.com"]
@@ -0,0 +1,51 @@
+import time
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy import select
+
+from server import cache, sweeper
+from server.models import User, ReferralCode
+
+pytestmark = pytest.mark.anyio
+
+EXPIRED = 5
+
+
+async def add_codes(db) -> None:
+    # Пользователь 1 — владелец истёкших кодов, пользователь 2 — активного
+    db.add_all([User(id=1, email="expired@example.com", password_hash="-"),
+                User(id=2, email="active@example.com", password_hash="-")])
+    await db.flush()
+    now = datetime.utcnow()
+    db.add_all(ReferralCode(code=f"OLD{i}", user_id=1, expiration_date=now - timedelta(days=i + 1))
+               for i in range(EXPIRED))
+    db.add(ReferralCode(code="ACTIVE", user_id=2, expiration_date=now + timedelta(days=30)))
+    await db.commit()
+
+
+async def test_sweep_deletes_only_expired_codes_in_batches(db, redis, monkeypatch):
+    await add_codes(db)
+    batches = []
+    sweep_batch = sweeper.sweep_batch
+
+    async def recording_sweep_batch(session, batch_size):
+        deleted = await sweep_batch(session, batch_size)
+        batches.append(deleted)
+        return deleted
+
+    monkeypatch.setattr(sweeper, "sweep_batch", recording_sweep_batch)
+    start = time.perf_counter()
+    assert await sweeper.sweep(batch_size=2, pause=0.05) == EXPIRED
+    assert batches == [2, 2, 1]
+    # Пауза выдерживается после каждой полной пачки
+    assert time.perf_counter() - start >= 0.1
+
+    remaining = (await db.execute(select(ReferralCode.code))).scalars().all()
+    assert remaining == ["ACTIVE"]
+
+    assert await redis.get(cache.referral_code_key("expired@example.com")) == cache.INVALIDATED_MARKER
+    assert await redis.get(cache.referral_code_key("active@example.com")) is None
+    for i in range(EXPIRED):
+        assert await redis.get(cache.valid_code_key(f"OLD{i}")) == cache.INVALIDATED_MARKER
+    assert await redis.get(cache.valid_code_key("ACTIVE")) is None